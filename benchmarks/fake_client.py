@@ -0,0 +1,201 @@
+"""Подмена TelegramClient для офлайн-бенчмарков.
+
+Поддерживает ровно те методы, которые используют TGScraper и PostPublisher:
+get_entity, get_messages, download_media, iter_download, send_message и send_file. Задержка,
+доля альбомов и размеры медиа настраиваются, генерация детерминирована (seed).
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Optional
+import asyncio
+import random
+
+from telethon.tl import types
+
+
+@dataclass
+class FakePhoto:
+    id: int
+    size: int = 0
+    access_hash: int = 0
+    file_reference: bytes = b''
+
+
+@dataclass
+class FakeDocument:
+    id: int
+    size: int = 0
+    mime_type: str = 'video/mp4'
+    access_hash: int = 0
+    file_reference: bytes = b''
+
+
+@dataclass
+class FakeFile:
+    size: int
+
+
+@dataclass
+class FakeMessage:
+    id: int
+    date: datetime
+    text: str = ''
+    grouped_id: Optional[int] = None
+    photo: Optional[FakePhoto] = None
+    document: Optional[FakeDocument] = None
+    entities: Optional[list] = None
+
+    @property
+    def raw_text(self) -> str:
+        return self.text
+
+    @property
+    def media(self):
+        return self.photo or self.document
+
+    @property
+    def file(self) -> Optional[FakeFile]:
+        return FakeFile(self.media.size) if self.media else None
+
+
+@dataclass
+class FakeStats:
+    get_entity: int = 0
+    get_messages: int = 0
+    download_media: int = 0
+    send_message: int = 0
+    send_file: int = 0
+    bytes_downloaded: int = 0
+    sent: list = field(default_factory=list)
+
+
+class FakeTelegramClient:
+    def __init__(self, channels: list[str], posts_per_channel: int = 50,
+                 latency: float = 0.05, album_ratio: float = 0.2, album_size: int = 4,
+                 media_ratio: float = 0.7, media_size: int = 256 * 1024,
+                 bandwidth: Optional[float] = None, seed: int = 1):
+        """latency - задержка одного запроса в секундах, bandwidth - байт/с на скачивание"""
+        self.latency = latency
+        self.media_size = media_size
+        self.bandwidth = bandwidth
+        self.stats = FakeStats()
+        self._rng = random.Random(seed)
+        self._channels = {
+            name: types.Channel(
+                id=1000 + i, title=name, photo=types.ChatPhotoEmpty(),
+                date=None, access_hash=i, username=name
+            )
+            for i, name in enumerate(channels)
+        }
+        self._names_by_id = {channel.id: name for name, channel in self._channels.items()}
+        self._messages = {
+            name: self._generate(posts_per_channel, album_ratio, album_size, media_ratio)
+            for name in channels
+        }
+
+    def _generate(self, posts: int, album_ratio: float, album_size: int, media_ratio: float) -> list:
+        messages = []
+        message_id = 1
+        date = datetime.now(timezone.utc) - timedelta(hours=posts)
+        for _ in range(posts):
+            date += timedelta(minutes=self._rng.randint(1, 60))
+            text = " ".join(f"слово{self._rng.randint(0, 5000)}" for _ in range(self._rng.randint(5, 80)))
+            if self._rng.random() < album_ratio:
+                grouped_id = self._rng.getrandbits(48)
+                for part in range(album_size):
+                    messages.append(self._media_message(message_id, date, text if part == 0 else '', grouped_id))
+                    message_id += 1
+            elif self._rng.random() < media_ratio:
+                messages.append(self._media_message(message_id, date, text))
+                message_id += 1
+            else:
+                messages.append(FakeMessage(id=message_id, date=date, text=text))
+                message_id += 1
+        return messages
+
+    def _media_message(self, message_id: int, date: datetime, text: str,
+                       grouped_id: Optional[int] = None) -> FakeMessage:
+        media_id = self._rng.getrandbits(62)
+        size = max(1, int(self._rng.uniform(0.5, 1.5) * self.media_size))
+        if self._rng.random() < 0.7:
+            return FakeMessage(id=message_id, date=date, text=text, grouped_id=grouped_id,
+                               photo=FakePhoto(media_id, size))
+        return FakeMessage(id=message_id, date=date, text=text, grouped_id=grouped_id,
+                           document=FakeDocument(media_id, size))
+
+    def _channel_name(self, entity) -> str:
+        if isinstance(entity, types.Channel):
+            return entity.username
+        if isinstance(entity, types.InputPeerChannel):
+            return self._names_by_id[entity.channel_id]
+        return str(entity).lstrip('@')
+
+    async def get_entity(self, entity):
+        self.stats.get_entity += 1
+        await asyncio.sleep(self.latency)
+        name = self._channel_name(entity)
+        if name not in self._channels:
+            # Цель публикации: создаём канал на лету
+            self._channels[name] = types.Channel(
+                id=1000 + len(self._channels), title=name, photo=types.ChatPhotoEmpty(),
+                date=None, access_hash=len(self._channels), username=name
+            )
+            self._names_by_id[self._channels[name].id] = name
+        return self._channels[name]
+
+    async def get_messages(self, entity, limit: int = 20, offset_id: int = 0,
+                           min_id: int = 0, ids=None):
+        self.stats.get_messages += 1
+        await asyncio.sleep(self.latency)
+        messages = self._messages[self._channel_name(entity)]
+        if ids is not None:
+            wanted = set(ids if isinstance(ids, list) else [ids])
+            return [msg for msg in messages if msg.id in wanted]
+        selected = [
+            msg for msg in reversed(messages)
+            if msg.id > min_id and (not offset_id or msg.id < offset_id)
+        ]
+        return selected[:limit]
+
+    async def download_media(self, message, file=None, thumb=None, progress_callback=None):
+        self.stats.download_media += 1
+        # Как и Telethon, принимает и сообщение, и само медиа
+        media = message.media if isinstance(message, FakeMessage) else message
+        size = media.size
+        delay = self.latency + (size / self.bandwidth if self.bandwidth else 0)
+        await asyncio.sleep(delay)
+
+        path = Path(file)
+        if path.is_dir():
+            path = path / f"{media.id}.bin"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(path.write_bytes, b'\0' * size)
+        self.stats.bytes_downloaded += size
+        if progress_callback:
+            progress_callback(size, size)
+        return str(path)
+
+    async def iter_download(self, file, offset: int = 0, request_size: int = 512 * 1024,
+                            file_size: Optional[int] = None, **kwargs):
+        self.stats.download_media += 1
+        size = file_size or file.size
+        while offset < size:
+            chunk = min(request_size, size - offset)
+            await asyncio.sleep(self.latency + (chunk / self.bandwidth if self.bandwidth else 0))
+            self.stats.bytes_downloaded += chunk
+            offset += chunk
+            yield b'\0' * chunk
+
+    async def send_message(self, entity, message, **kwargs):
+        self.stats.send_message += 1
+        await asyncio.sleep(self.latency)
+        self.stats.sent.append(('message', len(message or '')))
+        return FakeMessage(id=len(self.stats.sent), date=datetime.now(timezone.utc), text=message)
+
+    async def send_file(self, entity, file, caption=None, **kwargs):
+        self.stats.send_file += 1
+        files = file if isinstance(file, list) else [file]
+        await asyncio.sleep(self.latency * len(files))
+        self.stats.sent.append(('file', len(files)))
+        return FakeMessage(id=len(self.stats.sent), date=datetime.now(timezone.utc), text=caption or '')
@@ -0,0 +1,78 @@
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, Optional
+
+
+@dataclass(slots=True)
+class MessageRecord:
+    """Только те поля сообщения Telethon, что нужны для поста и скачивания медиа"""
+    id: int
+    date: datetime
+    text: str
+    grouped_id: Optional[int] = None
+    media: object = None
+    photo: object = None
+    document: object = None
+    file_size: Optional[int] = None
+    entities: Optional[list] = None
+
+    @classmethod
+    def from_message(cls, msg) -> Optional["MessageRecord"]:
+        """None для сообщений без текста и медиа (служебные и т.п.)"""
+        if not (msg.text or msg.media):
+            return None
+        return cls(
+            id=msg.id,
+            date=msg.date,
+            # Текст без разметки, форматирование - отдельно в entities
+            text=msg.raw_text or "",
+            grouped_id=getattr(msg, 'grouped_id', None),
+            media=msg.media,
+            photo=msg.photo,
+            document=msg.document,
+            file_size=msg.file.size if msg.file else None,
+            entities=msg.entities,
+        )
+
+
+class AlbumAssembler:
+    """Собирает посты из страниц сообщений за один линейный проход.
+
+    Части альбома в истории канала идут подряд по id, поэтому альбом
+    завершён, как только встретилось сообщение не из него. Последний
+    альбом страницы придерживается до следующей страницы или finish().
+    Страницы подаются от новых сообщений к старым, как их отдаёт get_messages.
+    """
+
+    def __init__(self):
+        self._pending: list[MessageRecord] = []
+
+    def feed(self, messages: Iterable) -> list[list[MessageRecord]]:
+        """Возвращает завершённые посты страницы, от новых к старым"""
+        records = [record for record in map(MessageRecord.from_message, messages) if record]
+        records.sort(key=lambda record: record.id, reverse=True)
+
+        posts = []
+        for record in records:
+            if self._pending and (record.grouped_id is None
+                                  or record.grouped_id != self._pending[0].grouped_id):
+                posts.append(self._close())
+            if record.grouped_id is None:
+                posts.append([record])
+            else:
+                self._pending.append(record)
+        return posts
+
+    def finish(self) -> list[list[MessageRecord]]:
+        """Отдаёт придержанный альбом: сообщений больше не будет"""
+        return [self._close()] if self._pending else []
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def _close(self) -> list[MessageRecord]:
+        # Внутри поста сообщения по возрастанию id: первое задаёт post_id
+        group = self._pending[::-1]
+        self._pending = []
+        return group
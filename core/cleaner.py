@@ -0,0 +1,206 @@
+from pathlib import Path
+from typing import Optional
+import asyncio
+import os
+import time
+
+from .db_manager import DBManager
+from .recompress import optimized_path, keep_marker
+
+
+class MediaJanitor:
+    """Фоновая уборка: просроченные посты, пустые папки и квота на диск.
+
+    Работает порциями и выносит всю работу с файлами из event loop, чтобы
+    не мешать парсингу и публикации. quota_bytes ограничивает место под
+    медиа неопубликованных постов: при превышении вытесняются самые старые. Неопубликованные посты живут
+    retention_days, опубликованные - published_retention_days (0 - вечно);
+    при секционированной БД старые посты удаляются целыми секциями.
+    """
+
+    def __init__(self, db: DBManager, media_root: str = "media", interval: int = 600,
+                 retention_days: int = 3, quota_bytes: Optional[int] = None,
+                 chunk_size: int = 500, evict_chunk_size: int = 20,
+                 published_retention_days: int = 0):
+        self.db = db
+        self.media_root = Path(media_root)
+        self.interval = interval
+        self.retention_days = retention_days
+        self.published_retention_days = published_retention_days
+        self.quota_bytes = quota_bytes
+        self.chunk_size = chunk_size
+        self.evict_chunk_size = evict_chunk_size
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"❌ Ошибка фоновой очистки: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """Один проход уборки, возвращает число освобождённых байт"""
+        reclaimed = 0
+        expired = 0
+        # Секции на ближайшие дни создаём заранее
+        await self.db.ensure_partitions()
+
+        while True:
+            deleted, media_files = await self.db.delete_expired_posts(self.retention_days, self.chunk_size)
+            reclaimed += await self.db.remove_files(media_files)
+            expired += deleted
+            if deleted < self.chunk_size:
+                break
+
+        if self.published_retention_days:
+            published, freed = await self._expire_published()
+            expired += published
+            reclaimed += freed
+
+        evicted = 0
+        if self.quota_bytes:
+            # Квота - на то, что можно вытеснить: опубликованные медиа живут
+            # по published_retention_days, и удаление постов их не уменьшит
+            used = await asyncio.to_thread(self._files_size, await self.db.get_evictable_files())
+            # Сначала вытесняем самые старые неопубликованные посты с медиа
+            while used > self.quota_bytes:
+                deleted, media_files = await self.db.delete_oldest_unpublished_with_media(self.evict_chunk_size)
+                freed = await self.db.remove_files(media_files)
+                reclaimed += freed
+                used -= freed
+                evicted += deleted
+                if not freed:
+                    print(f"⚠️ Медиа неопубликованных постов занимают {used / 1024 / 1024:.0f} МБ, "
+                          f"но вытеснение ничего не освободило")
+                    break
+
+        pruned = await asyncio.to_thread(self._prune_empty_dirs)
+
+        if expired or evicted or pruned:
+            print(f"🧹 Очистка: просроченных постов {expired}, вытеснено по квоте {evicted}, "
+                  f"пустых папок {pruned}, освобождено {reclaimed / 1024 / 1024:.1f} МБ")
+        return reclaimed
+
+    async def reconcile(self, downloader=None, grace_seconds: int = 3600) -> dict:
+        """Сверка media/ с БД при старте вместо полной очистки папки.
+
+        Целые файлы остаются на месте, битые и пропавшие файлы
+        неопубликованных постов скачиваются заново через downloader, а
+        файлы, на которые БД не ссылается, удаляются. Файлы моложе
+        grace_seconds не трогаем: их может как раз сохранять другой воркер.
+        Без downloader (у воркеров разные media/) ничего не докачивается.
+        """
+        files = await self.db.get_media_files()
+        missing, removed, freed = await asyncio.to_thread(self._check_files, files, grace_seconds)
+
+        total = len({row['path'] for row in files})
+        lost = sum(len(wanted) for wanted in missing.values())
+        restored = 0
+        if downloader is not None and not downloader.reference_only:
+            for channel, wanted in missing.items():
+                try:
+                    restored += await downloader.restore(channel, wanted)
+                except Exception as e:
+                    print(f"❌ Не удалось восстановить медиа канала {channel}: {e}")
+
+        print(f"🗂️ Сверка медиа: файлов в БД {total}, восстановлено {restored} из {lost}, "
+              f"удалено лишних {removed} ({freed / 1024 / 1024:.1f} МБ)")
+        return {'files': total, 'missing': lost, 'restored': restored, 'removed': removed}
+
+    def _check_files(self, files: list[dict], grace_seconds: int):
+        # Пути из БД относительные, сравниваем абсолютные
+        keep = set()
+        missing: dict[str, dict[int, str]] = {}
+        checked: dict[str, bool] = {}
+        for row in files:
+            path = Path(row['path'])
+            key = os.path.abspath(path)
+            keep.update(os.path.abspath(variant) for variant in (
+                path, path.with_name(path.name + '.part'), optimized_path(path), keep_marker(path)
+            ))
+            if key in checked:
+                continue
+            checked[key] = self._is_intact(path, row['size'])
+            if not checked[key] and row['pending'] and row['tg_message_id']:
+                missing.setdefault(row['channel_name'], {})[row['tg_message_id']] = row['path']
+
+        removed = 0
+        freed = 0
+        now = time.time()
+        for root, _, names in os.walk(self.media_root):
+            for name in names:
+                path = os.path.abspath(os.path.join(root, name))
+                if path in keep:
+                    continue
+                try:
+                    stat = os.stat(path)
+                    if now - stat.st_mtime < grace_seconds:
+                        continue
+                    os.unlink(path)
+                except OSError:
+                    continue
+                removed += 1
+                freed += stat.st_size
+        return missing, removed, freed
+
+    @staticmethod
+    def _is_intact(path: Path, size: Optional[int]) -> bool:
+        try:
+            actual = path.stat().st_size
+        except OSError:
+            return False
+        if not size or actual == size:
+            return True
+        # Размер не сходится: файл битый, вместе с ним выбрасываем и производные
+        print(f"⚠️ Размер {path} не совпадает с БД ({actual} вместо {size}), скачаем заново")
+        for variant in (path, optimized_path(path), keep_marker(path)):
+            variant.unlink(missing_ok=True)
+        return False
+
+    async def _expire_published(self) -> tuple[int, int]:
+        expired = 0
+        reclaimed = 0
+        if self.db.partitioned:
+            # В секции лежат и неопубликованные посты, они к этому времени уже просрочены
+            keep_days = max(self.published_retention_days, self.retention_days)
+            deleted, media_files = await self.db.drop_expired_partitions(keep_days)
+            reclaimed += await self.db.remove_files(media_files)
+            expired += deleted
+
+        # Без секций (и для строк в DEFAULT-секции) - порциями
+        while True:
+            deleted, media_files = await self.db.delete_expired_published_posts(
+                self.published_retention_days, self.chunk_size
+            )
+            reclaimed += await self.db.remove_files(media_files)
+            expired += deleted
+            if deleted < self.chunk_size:
+                break
+
+        await self.db.delete_applied_outbox(self.published_retention_days)
+        return expired, reclaimed
+
+    @staticmethod
+    def _files_size(paths: list[str]) -> int:
+        total = 0
+        for path in paths:
+            try:
+                total += os.stat(path).st_size
+            except OSError:
+                pass
+        return total
+
+    def _prune_empty_dirs(self) -> int:
+        pruned = 0
+        for root, dirs, files in os.walk(self.media_root, topdown=False):
+            if Path(root) == self.media_root or files:
+                continue
+            try:
+                # Свежие папки не трогаем: в них может как раз начаться скачивание
+                if not os.listdir(root) and time.time() - os.stat(root).st_mtime > 60:
+                    os.rmdir(root)
+                    pruned += 1
+            except OSError:
+                pass
+        return pruned
@@ -1,5 +1,27 @@
-from telethon import TelegramClient
+from telethon import TelegramClient, errors
 from os.path import exists
+from typing import Optional
+import asyncio
+import bisect
+import hashlib
+import time
+
+from .peers import PeerCache
+
+
+# Аккаунт заблокирован или сессия отозвана: больше его не используем
+BAN_ERRORS = (
+    errors.UserDeactivatedBanError,
+    errors.UserDeactivatedError,
+    errors.AuthKeyUnregisteredError,
+    errors.SessionRevokedError,
+    errors.PhoneNumberBannedError,
+)
+
+
+class AccountPaused(Exception):
+    """Аккаунт ушёл на паузу по FloodWait, а в пуле есть свободные"""
+
 
 class TelegramClientManager:
     def __init__(self, session_file, api_id, api_hash, phone):
@@ -13,4 +35,137 @@ class TelegramClientManager:
             self.client.session.save()
         else:
             await self.client.start()
-        return self.client
\ No newline at end of file
+        return self.client
+
+
+class Account:
+    """Аккаунт пула: свой клиент, свой лимит частоты запросов и свой кэш peer"""
+
+    def __init__(self, name: str, client, request_interval: float = 0.5,
+                 peers: Optional[PeerCache] = None):
+        self.name = name
+        self.client = client
+        self.peers = peers
+        # Минимальный интервал между запросами к Telegram для всего аккаунта
+        self.request_interval = request_interval
+        self.banned = False
+        self.active_downloads = 0
+        self._request_lock = asyncio.Lock()
+        self._last_request_at = 0.0
+        self._paused_until = 0.0
+
+    async def throttle(self):
+        """Ограничивает частоту запросов аккаунта, общую для всех каналов"""
+        async with self._request_lock:
+            now = time.monotonic()
+            wait = max(
+                self._paused_until - now,
+                self._last_request_at + self.request_interval - now
+            )
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_request_at = time.monotonic()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @property
+    def available(self) -> bool:
+        return not self.banned and self._paused_until <= time.monotonic()
+
+
+class ClientPool:
+    """Несколько аккаунтов Telegram с распределением работы между ними.
+
+    Каналы закрепляются за аккаунтами консистентным хешированием: при
+    выпадении аккаунта (FloodWait, бан) на другие переезжают только его
+    каналы. Скачивания идут через наименее загруженный аккаунт.
+    """
+
+    def __init__(self, accounts: list[Account], virtual_nodes: int = 100):
+        if not accounts:
+            raise ValueError("в пуле нет ни одного аккаунта")
+        self.accounts = accounts
+        self._ring = sorted(
+            (self._hash(f"{account.name}#{i}"), index)
+            for index, account in enumerate(accounts)
+            for i in range(virtual_nodes)
+        )
+        self._ring_keys = [key for key, _ in self._ring]
+
+    @classmethod
+    def single(cls, client, request_interval: float = 0.5,
+               peers: Optional[PeerCache] = None) -> "ClientPool":
+        """Пул из одного уже запущенного клиента"""
+        return cls([Account("default", client, request_interval, peers)])
+
+    @classmethod
+    async def start(cls, session_files: list[str], api_id, api_hash, phones: list[str],
+                    request_interval: float = 0.5) -> "ClientPool":
+        """Запускает клиенты всех сессий; не запустившиеся аккаунты пропускаются"""
+        accounts = []
+        for i, session_file in enumerate(session_files):
+            phone = phones[i] if i < len(phones) else phones[-1]
+            try:
+                client = await TelegramClientManager(session_file, api_id, api_hash, phone).start()
+            except Exception as e:
+                print(f"❌ Не удалось запустить аккаунт {session_file}: {e}")
+                continue
+            accounts.append(Account(session_file, client, request_interval))
+        print(f"✅ Запущено аккаунтов: {len(accounts)} из {len(session_files)}")
+        return cls(accounts)
+
+    @property
+    def primary(self) -> Account:
+        return self.accounts[0]
+
+    @property
+    def size(self) -> int:
+        return len(self.accounts)
+
+    def use_peer_cache(self, db, ttl: float):
+        for account in self.accounts:
+            account.peers = PeerCache(account.client, db, ttl=ttl, account=account.name)
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+    def account_for(self, key: str) -> Account:
+        """Аккаунт, за которым закреплён канал; занятые и забаненные пропускаются"""
+        start = bisect.bisect(self._ring_keys, self._hash(key))
+        for offset in range(len(self._ring)):
+            account = self.accounts[self._ring[(start + offset) % len(self._ring)][1]]
+            if account.available:
+                return account
+        return self._least_paused()
+
+    def ensure_available(self, account: Account):
+        """Не даёт ждать паузу аккаунта, если работу может взять другой"""
+        if not account.available and any(other.available for other in self.accounts):
+            raise AccountPaused(account.name)
+
+    def least_loaded(self) -> Account:
+        available = [account for account in self.accounts if account.available]
+        if not available:
+            return self._least_paused()
+        return min(available, key=lambda account: account.active_downloads)
+
+    def _least_paused(self) -> Account:
+        # Все аккаунты на паузе: берём тот, что освободится раньше (throttle дождётся)
+        alive = [account for account in self.accounts if not account.banned]
+        if not alive:
+            raise RuntimeError("все аккаунты пула заблокированы")
+        return min(alive, key=lambda account: account._paused_until)
+
+    def report_flood(self, account: Account, seconds: float):
+        account.pause(seconds)
+        print(f"⏳ FloodWait {seconds} с. на аккаунте {account.name}, работа переходит к другим аккаунтам")
+
+    def report_ban(self, account: Account, error: Exception):
+        account.banned = True
+        print(f"🚫 Аккаунт {account.name} отключён: {error}")
+
+    async def disconnect(self):
+        for account in self.accounts:
+            await account.client.disconnect()
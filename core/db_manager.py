@@ -1,37 +1,143 @@
 import os
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
-from .db_models import Base, Post, Media
-from sqlalchemy import update, delete, and_, func, select
-from sqlalchemy.exc import IntegrityError
+from .db_models import Base, Post, Media, MediaBlob, ChannelCursor, PublishOutbox, ResolvedPeer, JobLease
+from sqlalchemy import update, delete, and_, or_, func, select, tuple_, text, bindparam, exists, case
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime, timedelta, timezone
+from typing import Optional
+from .storage import MediaStore
+from .metrics import db_call, BACKLOG, DB_POOL
+
+
+# Изменения схемы для уже существующих таблиц: create_all их не добавляет
+SCHEMA_UPGRADES = [
+    "ALTER TABLE media ADD COLUMN IF NOT EXISTS blob_id INTEGER "
+    "REFERENCES media_blobs(id) ON DELETE SET NULL",
+    "CREATE INDEX IF NOT EXISTS ix_media_blob_id ON media (blob_id)",
+    "ALTER TABLE posts ADD COLUMN IF NOT EXISTS is_duplicate BOOLEAN NOT NULL DEFAULT false",
+    "ALTER TABLE posts ADD COLUMN IF NOT EXISTS publish_attempts INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE media ALTER COLUMN file_path DROP NOT NULL",
+    "ALTER TABLE media ADD COLUMN IF NOT EXISTS tg_message_id INTEGER",
+    "ALTER TABLE media ADD COLUMN IF NOT EXISTS tg_kind VARCHAR(20)",
+    "ALTER TABLE media ADD COLUMN IF NOT EXISTS tg_id BIGINT",
+    "ALTER TABLE media ADD COLUMN IF NOT EXISTS tg_access_hash BIGINT",
+    "ALTER TABLE media ADD COLUMN IF NOT EXISTS tg_file_reference BYTEA",
+    "ALTER TABLE media ADD COLUMN IF NOT EXISTS post_date TIMESTAMPTZ",
+    # Полнотекстовый поиск для core/view_posts.py
+    "ALTER TABLE posts ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('russian', coalesce(text, ''))) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_posts_search ON posts USING GIN (search_vector)",
+    "ALTER TABLE posts ADD COLUMN IF NOT EXISTS entities JSON",
+    "ALTER TABLE media ADD COLUMN IF NOT EXISTS tg_account VARCHAR(100)",
+    "ALTER TABLE channel_cursors ADD COLUMN IF NOT EXISTS gap_from INTEGER",
+    "ALTER TABLE channel_cursors ADD COLUMN IF NOT EXISTS gap_to INTEGER",
+]
+
+# Секционированные по дате posts и media (POSTS_PARTITIONING=1, только для новой БД).
+# Ключ секционирования должен входить в PK и уникальные индексы, поэтому
+# уникальность поста - (channel_name, post_id, date): дата сообщения не меняется.
+PARTITIONED_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS posts (
+        id SERIAL,
+        post_id INTEGER NOT NULL,
+        channel_name VARCHAR(100) NOT NULL,
+        text TEXT,
+        entities JSON,
+        published BOOLEAN NOT NULL DEFAULT false,
+        is_duplicate BOOLEAN NOT NULL DEFAULT false,
+        publish_attempts INTEGER NOT NULL DEFAULT 0,
+        date TIMESTAMPTZ NOT NULL,
+        scraped_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (id, date)
+    ) PARTITION BY RANGE (date)
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_posts_channel_post ON posts (channel_name, post_id, date)",
+    "CREATE INDEX IF NOT EXISTS ix_posts_published ON posts (published)",
+    "CREATE INDEX IF NOT EXISTS ix_posts_date ON posts (date)",
+    "CREATE TABLE IF NOT EXISTS posts_default PARTITION OF posts DEFAULT",
+    """
+    CREATE TABLE IF NOT EXISTS media (
+        id SERIAL,
+        post_id INTEGER NOT NULL,
+        channel_name VARCHAR(100) NOT NULL,
+        post_date TIMESTAMPTZ NOT NULL,
+        media_type VARCHAR(50) NOT NULL,
+        file_path VARCHAR(511),
+        tg_message_id INTEGER,
+        tg_kind VARCHAR(20),
+        tg_id BIGINT,
+        tg_access_hash BIGINT,
+        tg_file_reference BYTEA,
+        tg_account VARCHAR(100),
+        blob_id INTEGER REFERENCES media_blobs(id) ON DELETE SET NULL,
+        PRIMARY KEY (id, post_date),
+        CONSTRAINT fk_media_post FOREIGN KEY (post_id, channel_name, post_date)
+            REFERENCES posts (post_id, channel_name, date) ON DELETE CASCADE
+    ) PARTITION BY RANGE (post_date)
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_media_post_channel ON media (post_id, channel_name)",
+    "CREATE TABLE IF NOT EXISTS media_default PARTITION OF media DEFAULT",
+]
 
 
 class DBManager:
-    def __init__(self):
-        db_config = {
-            'host': os.getenv('DB_HOST'),
-            'port': os.getenv('DB_PORT'),
-            'database': os.getenv('DB_NAME'),
-            'user': os.getenv('DB_USER'),
-            'password': os.getenv('DB_PASSWORD')
-        }
-        self.db_url = (
-            f"postgresql+asyncpg://{db_config['user']}:"
-            f"{db_config['password']}@{db_config['host']}:"
-            f"{db_config['port']}/{db_config['database']}"
-        )
+    def __init__(self, db_url: Optional[str] = None, partitioned: bool = False):
+        """db_url по умолчанию собирается из DB_* переменных окружения (Postgres).
+
+        SQLite (sqlite+aiosqlite://) поддерживается для бенчмарков и отладки.
+        partitioned - создать posts и media секционированными по дате
+        (только Postgres и только если таблиц ещё нет).
+        """
+        if db_url is None:
+            db_config = {
+                'host': os.getenv('DB_HOST'),
+                'port': os.getenv('DB_PORT'),
+                'database': os.getenv('DB_NAME'),
+                'user': os.getenv('DB_USER'),
+                'password': os.getenv('DB_PASSWORD')
+            }
+            db_url = (
+                f"postgresql+asyncpg://{db_config['user']}:"
+                f"{db_config['password']}@{db_config['host']}:"
+                f"{db_config['port']}/{db_config['database']}"
+            )
+        self.db_url = db_url
         self.engine = create_async_engine(self.db_url, echo=False)
         self.async_session = sessionmaker(
             self.engine, expire_on_commit=False, class_=AsyncSession
         )
+        self.is_postgres = self.engine.dialect.name == 'postgresql'
+        # INSERT ... ON CONFLICT есть в обоих диалектах, но конструкторы разные
+        self._insert = postgresql.insert if self.is_postgres else sqlite.insert
+        self.use_partitions = partitioned and self.is_postgres
+        # Выставляется в initialize по фактической схеме таблицы posts
+        self.partitioned = False
+        self._post_conflict = ['channel_name', 'post_id']
 
     async def initialize(self):
         async with self.engine.begin() as conn:
+            if self.use_partitions:
+                await conn.run_sync(MediaBlob.__table__.create, checkfirst=True)
+                for statement in PARTITIONED_TABLES:
+                    await conn.execute(text(statement))
             await conn.run_sync(Base.metadata.create_all)
+            if self.is_postgres:
+                for statement in SCHEMA_UPGRADES:
+                    await conn.execute(text(statement))
+                self.partitioned = await conn.scalar(text(
+                    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table pt "
+                    "JOIN pg_class c ON c.oid = pt.partrelid WHERE c.relname = 'posts')"
+                ))
+        if self.use_partitions and not self.partitioned:
+            print("⚠️ Таблица posts создана без секционирования, старые посты удаляются построчно")
+        if self.partitioned:
+            self._post_conflict = ['channel_name', 'post_id', 'date']
+            await self.ensure_partitions()
         print("✅ База данных инициализирована")
-        await self.cleanup_old_posts(days=3)
 
+    @db_call
     async def post_exists(self, post_id: int, channel_name: str) -> bool:
         """Проверяет, существует ли пост в базе"""
         async with self.async_session() as session:
@@ -43,42 +149,491 @@ class DBManager:
             )
             return result.scalar() is not None
 
-    async def add_post(self, post_data: dict) -> bool:
+    @db_call
+    async def get_existing_post_keys(self, keys: list[tuple[str, int]]) -> set[tuple[str, int]]:
+        """Возвращает те ключи (channel_name, post_id), которые уже есть в базе"""
+        if not keys:
+            return set()
         async with self.async_session() as session:
-            # Проверяем, существует ли пост
-            exists = await self.post_exists(post_data['id'], post_data['channel'])
-            if exists:
-                return False
+            result = await session.execute(
+                select(Post.channel_name, Post.post_id).where(
+                    tuple_(Post.channel_name, Post.post_id).in_(set(keys))
+                )
+            )
+            return {(channel, post_id) for channel, post_id in result.all()}
 
-            new_post = Post(
-                post_id=post_data['id'],
-                channel_name=post_data['channel'],
-                date=post_data['date'],
-                text=post_data['text']
+    @db_call
+    async def get_channel_cursor(self, channel_name: str) -> Optional[int]:
+        """Возвращает id последнего обработанного сообщения канала"""
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(ChannelCursor.last_message_id).where(
+                    ChannelCursor.channel_name == channel_name
+                )
+            )
+            return result.scalar()
+
+    @db_call
+    async def get_channel_gap(self, channel_name: str) -> Optional[tuple[int, int]]:
+        """Незаполненный пропуск канала (gap_from, gap_to) или None"""
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(ChannelCursor.gap_from, ChannelCursor.gap_to).where(
+                    ChannelCursor.channel_name == channel_name,
+                    ChannelCursor.gap_from.is_not(None)
+                )
             )
+            row = result.first()
+            return tuple(row) if row else None
 
-            for m in post_data.get('media', []):
-                new_post.media.append(
-                    Media(
-                        post_id=post_data['id'],
-                        channel_name=post_data['channel'],
-                        media_type=m['type'],
-                        file_path=m['file_path']
+    @db_call
+    async def record_channel_gap(self, channel_name: str, from_id: int, to_id: int):
+        """Запоминает пропуск, расширяя уже записанный до общего диапазона"""
+        async with self.async_session() as session:
+            await session.execute(
+                update(ChannelCursor)
+                .where(ChannelCursor.channel_name == channel_name)
+                .values(
+                    gap_from=case(
+                        (ChannelCursor.gap_from < from_id, ChannelCursor.gap_from),
+                        else_=from_id
+                    ),
+                    gap_to=case(
+                        (ChannelCursor.gap_to > to_id, ChannelCursor.gap_to),
+                        else_=to_id
                     )
                 )
+            )
+            await session.commit()
 
-            session.add(new_post)
+    @db_call
+    async def clear_channel_gap(self, channel_name: str):
+        async with self.async_session() as session:
+            await session.execute(
+                update(ChannelCursor)
+                .where(ChannelCursor.channel_name == channel_name)
+                .values(gap_from=None, gap_to=None)
+            )
+            await session.commit()
+
+    @db_call
+    async def add_posts_bulk(self, posts: list[dict], cursor: Optional[tuple[str, int]] = None) -> int:
+        """Добавляет посты и их медиа одной транзакцией, дубликаты пропускаются.
+
+        Если передан cursor (channel_name, message_id), курсор канала
+        сдвигается в той же транзакции.
+        """
+        if not posts and cursor is None:
+            return 0
+        async with self.async_session() as session:
             try:
+                if cursor is not None:
+                    await self._advance_cursor(session, *cursor)
+                if not posts:
+                    await session.commit()
+                    return 0
+
+                stmt = (
+                    self._insert(Post)
+                    .values([
+                        {
+                            'post_id': p['id'],
+                            'channel_name': p['channel'],
+                            'date': p['date'],
+                            'text': p['text'],
+                            'entities': p.get('entities'),
+                            'is_duplicate': p.get('is_duplicate', False),
+                        }
+                        for p in posts
+                    ])
+                    .on_conflict_do_nothing(index_elements=self._post_conflict)
+                    .returning(Post.channel_name, Post.post_id)
+                )
+                inserted = {(channel, post_id) for channel, post_id in (await session.execute(stmt)).all()}
+
+                new_media = [
+                    (p, m)
+                    for p in posts
+                    if (p['channel'], p['id']) in inserted
+                    for m in p.get('media', [])
+                ]
+                blob_ids = await self._acquire_blobs(
+                    session, [m['blob'] for _, m in new_media if m.get('blob')]
+                )
+                media_rows = [
+                    {
+                        'post_id': p['id'],
+                        'channel_name': p['channel'],
+                        'post_date': p['date'],
+                        'media_type': m['type'],
+                        'file_path': m['file_path'],
+                        'blob_id': blob_ids.get(m['blob']['key']) if m.get('blob') else None,
+                        **self._media_reference_columns(m.get('ref')),
+                    }
+                    for p, m in new_media
+                ]
+                if media_rows:
+                    await session.execute(self._insert(Media), media_rows)
+
                 await session.commit()
-                return True
-            except IntegrityError:
+                return len(inserted)
+            except Exception as e:
                 await session.rollback()
-                return False
+                print(f"❌ Ошибка пакетного добавления постов: {e}")
+                return 0
+
+    @db_call
+    async def get_blobs(self, keys: list[str]) -> dict[str, dict]:
+        """Возвращает уже сохранённые в хранилище файлы по ключам MediaStore"""
+        if not keys:
+            return {}
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(MediaBlob).where(MediaBlob.file_key.in_(set(keys)))
+            )
+            return {
+                blob.file_key: {
+                    'key': blob.file_key,
+                    'path': blob.file_path,
+                    'size': blob.size,
+                    'hash': blob.content_hash,
+                }
+                for blob in result.scalars()
+            }
+
+    @db_call
+    async def get_blob_paths_by_hash(self, hashes: list[str]) -> dict[str, str]:
+        """Возвращает пути файлов с тем же содержимым (sha256)"""
+        if not hashes:
+            return {}
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(MediaBlob.content_hash, MediaBlob.file_path)
+                .where(MediaBlob.content_hash.in_(set(hashes)))
+            )
+            return dict(result.all())
+
+    @db_call
+    async def get_media_files(self) -> list[dict]:
+        """Все файлы, на которые ссылается БД, с ожидаемым размером.
+
+        pending - файл нужен неопубликованному посту и при пропаже его
+        стоит скачать заново по channel_name и tg_message_id.
+        """
+        path = func.coalesce(MediaBlob.file_path, Media.file_path)
+        async with self.async_session() as session:
+            media = await session.execute(
+                select(
+                    path.label('path'),
+                    MediaBlob.size,
+                    Media.channel_name,
+                    Media.tg_message_id,
+                    and_(Post.published == False, Post.is_duplicate == False).label('pending')
+                )
+                .select_from(Media)
+                .join(Post, and_(Post.post_id == Media.post_id, Post.channel_name == Media.channel_name))
+                .outerjoin(MediaBlob, MediaBlob.id == Media.blob_id)
+                .where(path.is_not(None))
+            )
+            files = [dict(row) for row in media.mappings()]
+            # Блобы без строк Media (счётчик ещё не обнулён) тоже не трогаем
+            blobs = await session.execute(select(MediaBlob.file_path, MediaBlob.size))
+            files.extend(
+                {'path': file_path, 'size': size, 'channel_name': None,
+                 'tg_message_id': None, 'pending': False}
+                for file_path, size in blobs.all()
+            )
+            return files
+
+    async def _acquire_blobs(self, session, blobs: list[dict]) -> dict[str, int]:
+        """Создаёт записи MediaBlob или увеличивает их счётчики ссылок"""
+        if not blobs:
+            return {}
+        refs = {}
+        for blob in blobs:
+            if blob['key'] in refs:
+                refs[blob['key']]['ref_count'] += 1
+            else:
+                refs[blob['key']] = {
+                    'file_key': blob['key'],
+                    'file_path': blob['path'],
+                    'size': blob['size'],
+                    'content_hash': blob.get('hash'),
+                    'ref_count': 1,
+                }
+        stmt = self._insert(MediaBlob).values(list(refs.values()))
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['file_key'],
+            set_={
+                'ref_count': MediaBlob.ref_count + stmt.excluded.ref_count,
+                'file_path': stmt.excluded.file_path,
+            }
+        ).returning(MediaBlob.file_key, MediaBlob.id)
+        result = await session.execute(stmt)
+        return dict(result.all())
+
+    # Собственный файл поста: не из хранилища. Старые строки, отвязанные от
+    # MediaBlob до сброса file_path, могут указывать на живой общий файл
+    _own_file = and_(
+        Media.blob_id.is_(None),
+        Media.file_path.is_not(None),
+        ~exists().where(MediaBlob.file_path == Media.file_path)
+    )
+
+    async def _release_blobs(self, session, media_filter) -> list[str]:
+        """Отвязывает медиа от MediaBlob и уменьшает счётчики ссылок.
+
+        Возвращает пути файлов, на которые больше никто не ссылается.
+        """
+        result = await session.execute(
+            select(Media.blob_id, func.count())
+            .where(media_filter, Media.blob_id.is_not(None))
+            .group_by(Media.blob_id)
+        )
+        refs = result.all()
+        if not refs:
+            return []
+
+        await session.execute(
+            update(Media)
+            .where(media_filter, Media.blob_id.is_not(None))
+            # Путь тоже сбрасываем: файл общий, и без blob_id строку
+            # нельзя было бы отличить от собственного файла поста
+            .values(blob_id=None, file_path=None)
+            .execution_options(synchronize_session=False)
+        )
+        conn = await session.connection()
+        await conn.execute(
+            update(MediaBlob.__table__)
+            .where(MediaBlob.__table__.c.id == bindparam('b_id'))
+            .values(ref_count=MediaBlob.__table__.c.ref_count - bindparam('b_refs')),
+            [{'b_id': blob_id, 'b_refs': count} for blob_id, count in refs]
+        )
+        deleted = await session.execute(
+            delete(MediaBlob)
+            .where(MediaBlob.id.in_([blob_id for blob_id, _ in refs]), MediaBlob.ref_count <= 0)
+            .returning(MediaBlob.file_path)
+        )
+        paths = {path for (path,) in deleted.all()}
+        if not paths:
+            return []
+
+        # Файл мог достаться другой записи при дедупликации по содержимому
+        still_used = await session.execute(
+            select(MediaBlob.file_path).where(MediaBlob.file_path.in_(paths))
+        )
+        return list(paths - {path for (path,) in still_used.all()})
+
+    @db_call
+    async def remove_files(self, paths: list[str]) -> int:
+        """Удаляет освобождённые файлы с диска, возвращает число освобождённых байт.
+
+        Между освобождением ссылок и удалением парсер мог заново сослаться
+        на тот же файл хранилища: такие файлы оставляем.
+        """
+        if not paths:
+            return 0
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(MediaBlob.file_path).where(MediaBlob.file_path.in_(set(paths)))
+            )
+            referenced = {path for (path,) in result.all()}
+        return await MediaStore.remove_files([path for path in paths if path not in referenced])
+
+    @db_call
+    async def release_post_media(self, post_id: int, channel: str) -> list[str]:
+        """Освобождает ссылки поста на общие файлы, возвращает файлы к удалению"""
+        async with self.async_session() as session:
+            try:
+                paths = await self._release_blobs(
+                    session,
+                    and_(Media.post_id == post_id, Media.channel_name == channel)
+                )
+                await session.commit()
+                return paths
             except Exception as e:
                 await session.rollback()
-                print(f"❌ Ошибка добавления поста: {e}")
-                return False
+                print(f"❌ Ошибка освобождения медиа: {e}")
+                return []
+
+    @db_call
+    async def get_peer(self, account: str, username: str) -> Optional[dict]:
+        """Возвращает сохранённый для аккаунта peer username или None"""
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(ResolvedPeer).where(
+                    ResolvedPeer.account == account,
+                    ResolvedPeer.username == username
+                )
+            )
+            peer = result.scalar()
+            if peer is None:
+                return None
+            return {
+                'peer_type': peer.peer_type,
+                'peer_id': peer.peer_id,
+                'access_hash': peer.access_hash,
+                'updated_at': peer.updated_at,
+            }
+
+    @db_call
+    async def save_peer(self, account: str, username: str, peer_type: str,
+                        peer_id: int, access_hash: Optional[int]):
+        async with self.async_session() as session:
+            values = {
+                'peer_type': peer_type,
+                'peer_id': peer_id,
+                'access_hash': access_hash,
+                'updated_at': datetime.now(timezone.utc),
+            }
+            stmt = self._insert(ResolvedPeer).values(account=account, username=username, **values)
+            stmt = stmt.on_conflict_do_update(index_elements=['account', 'username'], set_=values)
+            await session.execute(stmt)
+            await session.commit()
 
+    @db_call
+    async def delete_peer(self, account: str, username: str):
+        async with self.async_session() as session:
+            await session.execute(
+                delete(ResolvedPeer).where(
+                    ResolvedPeer.account == account,
+                    ResolvedPeer.username == username
+                )
+            )
+            await session.commit()
+
+    @db_call
+    async def ensure_jobs(self, kind: str, names: list[str]):
+        """Заводит задания, которых ещё нет; уже существующие не трогает"""
+        if not names:
+            return
+        async with self.async_session() as session:
+            stmt = self._insert(JobLease).values([
+                {'kind': kind, 'name': name, 'next_run_at': datetime.now(timezone.utc)}
+                for name in names
+            ]).on_conflict_do_nothing(index_elements=['kind', 'name'])
+            await session.execute(stmt)
+            await session.commit()
+
+    @db_call
+    async def claim_jobs(self, kind: str, names: list[str], owner: str,
+                         limit: int, lease_seconds: float) -> list[str]:
+        """Берёт в аренду подошедшие по времени свободные задания.
+
+        FOR UPDATE SKIP LOCKED: параллельные воркеры не ждут друг друга и не
+        получают одно задание дважды. Задание с истёкшей арендой (воркер
+        упал) снова считается свободным.
+        """
+        now = datetime.now(timezone.utc)
+        async with self.async_session() as session:
+            result = await session.execute(
+                select(JobLease.name)
+                .where(
+                    JobLease.kind == kind,
+                    JobLease.name.in_(names),
+                    JobLease.next_run_at <= now,
+                    or_(JobLease.lease_until.is_(None), JobLease.lease_until < now)
+                )
+                .order_by(JobLease.next_run_at)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+            candidates = list(result.scalars())
+            claimed = []
+            if candidates:
+                # Условие аренды повторяем в UPDATE: без SKIP LOCKED (SQLite)
+                # задание мог успеть забрать другой воркер
+                updated = await session.execute(
+                    update(JobLease)
+                    .where(
+                        JobLease.kind == kind,
+                        JobLease.name.in_(candidates),
+                        or_(JobLease.lease_until.is_(None), JobLease.lease_until < now)
+                    )
+                    .values(owner=owner, lease_until=now + timedelta(seconds=lease_seconds))
+                    .returning(JobLease.name)
+                )
+                claimed = list(updated.scalars())
+            await session.commit()
+            return claimed
+
+    @db_call
+    async def renew_leases(self, kind: str, names: list[str], owner: str,
+                           lease_seconds: float) -> set[str]:
+        """Продлевает аренду, возвращает задания, которые всё ещё за этим воркером"""
+        if not names:
+            return set()
+        async with self.async_session() as session:
+            result = await session.execute(
+                update(JobLease)
+                .where(
+                    JobLease.kind == kind,
+                    JobLease.name.in_(names),
+                    JobLease.owner == owner
+                )
+                .values(lease_until=datetime.now(timezone.utc) + timedelta(seconds=lease_seconds))
+                .returning(JobLease.name)
+            )
+            renewed = set(result.scalars())
+            await session.commit()
+            return renewed
+
+    @db_call
+    async def release_jobs(self, kind: str, names: list[str], owner: str, next_run_in: float):
+        """Снимает аренду и назначает следующий запуск через next_run_in секунд"""
+        if not names:
+            return
+        async with self.async_session() as session:
+            await session.execute(
+                update(JobLease)
+                .where(
+                    JobLease.kind == kind,
+                    JobLease.name.in_(names),
+                    JobLease.owner == owner
+                )
+                .values(
+                    owner=None,
+                    lease_until=None,
+                    next_run_at=datetime.now(timezone.utc) + timedelta(seconds=next_run_in)
+                )
+            )
+            await session.commit()
+
+    async def _advance_cursor(self, session, channel_name: str, message_id: int):
+        stmt = self._insert(ChannelCursor).values(
+            channel_name=channel_name,
+            last_message_id=message_id
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['channel_name'],
+            set_={
+                'last_message_id': case(
+                    (stmt.excluded.last_message_id > ChannelCursor.last_message_id,
+                     stmt.excluded.last_message_id),
+                    else_=ChannelCursor.last_message_id
+                ),
+                'updated_at': func.now(),
+            }
+        )
+        await session.execute(stmt)
+
+    @staticmethod
+    def _media_reference_columns(ref: Optional[dict]) -> dict:
+        ref = ref or {}
+        return {
+            'tg_message_id': ref.get('message_id'),
+            'tg_kind': ref.get('kind'),
+            'tg_id': ref.get('id'),
+            'tg_access_hash': ref.get('access_hash'),
+            'tg_file_reference': ref.get('file_reference'),
+            'tg_account': ref.get('account'),
+        }
+
+    @db_call
+    async def add_post(self, post_data: dict) -> bool:
+        return await self.add_posts_bulk([post_data]) == 1
+
+    @db_call
     async def mark_post_published(self, post_id: int, channel: str) -> bool:
         async with self.async_session() as session:
             try:
@@ -99,50 +654,298 @@ class DBManager:
                 print(f"❌ Ошибка отметки публикации: {e}")
                 return False
 
-    async def cleanup_old_posts(self, days: int = 3):
-        """Удаляет неопубликованные посты старше указанного количества дней"""
+    @db_call
+    async def record_publish_result(self, post_id: int, channel: str, target: str) -> bool:
+        """Записывает успешную отправку в outbox.
+
+        Коммит синхронный: потерянная запись означала бы повторную
+        отправку поста в канал.
+        """
+        async with self.async_session() as session:
+            try:
+                session.add(PublishOutbox(
+                    post_id=post_id,
+                    channel_name=channel,
+                    target=target,
+                    status='sent'
+                ))
+                await session.commit()
+                return True
+            except Exception as e:
+                await session.rollback()
+                print(f"❌ Ошибка записи в outbox: {e}")
+                return False
+
+    @db_call
+    async def flush_published(self) -> list[tuple[str, int]]:
+        """Переносит отправленные посты из outbox в posts.published одной транзакцией"""
+        async with self.async_session() as session:
+            try:
+                result = await session.execute(
+                    update(PublishOutbox)
+                    .where(PublishOutbox.applied == False, PublishOutbox.status == 'sent')
+                    .values(applied=True)
+                    .returning(PublishOutbox.channel_name, PublishOutbox.post_id)
+                )
+                keys = list({(channel, post_id) for channel, post_id in result.all()})
+                if keys:
+                    await session.execute(
+                        update(Post)
+                        .where(tuple_(Post.channel_name, Post.post_id).in_(keys))
+                        .values(published=True)
+                        .execution_options(synchronize_session=False)
+                    )
+                await session.commit()
+                return keys
+            except Exception as e:
+                await session.rollback()
+                print(f"❌ Ошибка применения outbox: {e}")
+                return []
+
+    @db_call
+    async def increment_publish_attempts(self, post_id: int, channel: str) -> int:
+        """Увеличивает счётчик неудачных попыток публикации, возвращает новое значение"""
+        async with self.async_session() as session:
+            try:
+                result = await session.execute(
+                    update(Post)
+                    .where(
+                        Post.post_id == post_id,
+                        Post.channel_name == channel
+                    )
+                    .values(publish_attempts=Post.publish_attempts + 1)
+                    .returning(Post.publish_attempts)
+                )
+                attempts = result.scalar() or 0
+                await session.commit()
+                return attempts
+            except Exception as e:
+                await session.rollback()
+                print(f"❌ Ошибка обновления попыток публикации: {e}")
+                return 0
+
+    async def _delete_posts(self, condition, limit: int) -> tuple[int, list[str]]:
+        """Удаляет до limit самых старых постов по условию.
+
+        Возвращает число удалённых постов и файлы, которые можно удалить с диска.
+        """
         async with self.async_session() as session:
             try:
-                threshold = datetime.now(timezone.utc) - timedelta(days=days)
+                result = await session.execute(
+                    select(Post.id).where(condition).order_by(Post.date.asc()).limit(limit)
+                )
+                ids = list(result.scalars())
+                if not ids:
+                    return 0, []
+                chosen = Post.id.in_(ids)
 
-                # Сначала получаем медиа для удаления
+                # Файлы без хранилища удаляем сразу, общие файлы - только
+                # если на них больше нет ссылок
                 media_to_delete = await session.execute(
                     select(Media.file_path)
                     .join(Post)
-                    .where(
-                        and_(
-                            Post.published == False,
-                            Post.date < threshold
-                        )
-                    )
+                    .where(chosen, self._own_file)
                 )
                 media_files = [m[0] for m in media_to_delete.all()]
-
-                # Удаляем посты из БД
-                stmt = delete(Post).where(
-                    and_(
-                        Post.published == False,
-                        Post.date < threshold
-                    )
+                chosen_media = tuple_(Media.post_id, Media.channel_name).in_(
+                    select(Post.post_id, Post.channel_name).where(chosen)
                 )
-                result = await session.execute(stmt)
-                await session.commit()
+                media_files += await self._release_blobs(session, chosen_media)
 
-                # Удаляем файлы медиа
-                for file_path in media_files:
-                    try:
-                        path = Path(file_path)
-                        if path.exists():
-                            path.unlink()
-                    except Exception as e:
-                        print(f"Ошибка удаления файла {file_path}: {e}")
-
-                print(f"🗑️ Удалено {result.rowcount} старых неопубликованных постов")
-                return result.rowcount
+                await session.execute(delete(Post).where(chosen))
+                await session.commit()
+                return len(ids), media_files
             except Exception as e:
                 await session.rollback()
-                print(f"❌ Ошибка очистки старых постов: {e}")
-                return 0
+                print(f"❌ Ошибка удаления постов: {e}")
+                return 0, []
+
+    @db_call
+    async def delete_expired_posts(self, days: int, limit: int = 500) -> tuple[int, list[str]]:
+        """Удаляет порцию неопубликованных постов старше days дней"""
+        threshold = datetime.now(timezone.utc) - timedelta(days=days)
+        return await self._delete_posts(
+            and_(Post.published == False, Post.date < threshold),
+            limit
+        )
+
+    @db_call
+    async def delete_expired_published_posts(self, days: int, limit: int = 500) -> tuple[int, list[str]]:
+        """Удаляет порцию опубликованных постов старше days дней (без секционирования)"""
+        threshold = datetime.now(timezone.utc) - timedelta(days=days)
+        return await self._delete_posts(
+            and_(Post.published == True, Post.date < threshold),
+            limit
+        )
+
+    @db_call
+    async def ensure_partitions(self, days_ahead: int = 7) -> int:
+        """Создаёт дневные секции posts и media на days_ahead дней вперёд"""
+        if not self.partitioned:
+            return 0
+        today = datetime.now(timezone.utc).date()
+        created = 0
+        for offset in range(-1, days_ahead + 1):
+            day = today + timedelta(days=offset)
+            for table in ('posts', 'media'):
+                name = f"{table}_p{day:%Y%m%d}"
+                try:
+                    async with self.engine.begin() as conn:
+                        if await conn.scalar(text(f"SELECT to_regclass('{name}') IS NOT NULL")):
+                            continue
+                        await conn.execute(text(
+                            f"CREATE TABLE {name} PARTITION OF {table} "
+                            f"FOR VALUES FROM ('{day} 00:00:00+00') TO ('{day + timedelta(days=1)} 00:00:00+00')"
+                        ))
+                        created += 1
+                except Exception as e:
+                    # Обычно значит, что строки за этот день уже попали в DEFAULT-секцию
+                    print(f"❌ Не удалось создать секцию {name}: {e}")
+        if created:
+            print(f"🗂️ Создано секций: {created}")
+        return created
+
+    async def _partition_days(self) -> list:
+        async with self.engine.connect() as conn:
+            result = await conn.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = 'posts'"
+            ))
+            names = [name for (name,) in result.all()]
+        days = []
+        for name in names:
+            try:
+                days.append(datetime.strptime(name, "posts_p%Y%m%d").date())
+            except ValueError:
+                continue
+        return sorted(days)
+
+    @db_call
+    async def drop_expired_partitions(self, days: int) -> tuple[int, list[str]]:
+        """Отсоединяет и удаляет дневные секции, целиком старше days дней.
+
+        Вместо DELETE по строкам: без раздувания таблиц и долгих блокировок.
+        Возвращает число удалённых постов и файлы, которые можно удалить с диска.
+        """
+        if not self.partitioned:
+            return 0, []
+        threshold = (datetime.now(timezone.utc) - timedelta(days=days)).date()
+        deleted = 0
+        media_files = []
+        for day in await self._partition_days():
+            if day + timedelta(days=1) > threshold:
+                break
+            start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+            in_day = and_(Media.post_date >= start, Media.post_date < start + timedelta(days=1))
+            async with self.async_session() as session:
+                try:
+                    legacy = await session.execute(
+                        select(Media.file_path)
+                        .where(in_day, self._own_file)
+                    )
+                    files = [path for (path,) in legacy.all()]
+                    files += await self._release_blobs(session, in_day)
+                    posts = await session.scalar(
+                        select(func.count()).select_from(Post).where(
+                            Post.date >= start, Post.date < start + timedelta(days=1)
+                        )
+                    )
+                    suffix = f"p{day:%Y%m%d}"
+                    # Сначала media: её внешний ключ ссылается на секцию posts
+                    for table in ('media', 'posts'):
+                        await session.execute(text(f"ALTER TABLE {table} DETACH PARTITION {table}_{suffix}"))
+                        await session.execute(text(f"DROP TABLE {table}_{suffix}"))
+                    await session.commit()
+                except Exception as e:
+                    await session.rollback()
+                    print(f"❌ Ошибка удаления секции за {day}: {e}")
+                    break
+            deleted += posts or 0
+            media_files += files
+            print(f"🗂️ Удалена секция за {day}: {posts} постов")
+        return deleted, media_files
+
+    @db_call
+    async def delete_applied_outbox(self, days: int) -> int:
+        """Чистит журнал отправок: применённые записи старше days дней"""
+        threshold = datetime.now(timezone.utc) - timedelta(days=days)
+        async with self.async_session() as session:
+            result = await session.execute(
+                delete(PublishOutbox).where(
+                    PublishOutbox.applied == True,
+                    PublishOutbox.created_at < threshold
+                )
+            )
+            await session.commit()
+            return result.rowcount
+
+    @db_call
+    async def delete_oldest_unpublished_with_media(self, limit: int = 50) -> tuple[int, list[str]]:
+        """Удаляет порцию самых старых неопубликованных постов, у которых есть файлы на диске"""
+        has_files = exists().where(
+            Media.post_id == Post.post_id,
+            Media.channel_name == Post.channel_name,
+            Media.file_path.is_not(None)
+        )
+        return await self._delete_posts(and_(Post.published == False, has_files), limit)
+
+    @db_call
+    async def get_evictable_files(self) -> list[str]:
+        """Файлы, которые освободит вытеснение неопубликованных постов.
+
+        Собственные файлы таких постов и общие файлы, на которые не
+        ссылается ни один опубликованный пост.
+        """
+        of_post = and_(Post.post_id == Media.post_id, Post.channel_name == Media.channel_name)
+        async with self.async_session() as session:
+            own = await session.execute(
+                select(Media.file_path)
+                .join(Post, of_post)
+                .where(Post.published == False, self._own_file)
+            )
+            shared = await session.execute(
+                select(MediaBlob.file_path).where(
+                    exists().where(Media.blob_id == MediaBlob.id, of_post, Post.published == False),
+                    ~exists().where(Media.blob_id == MediaBlob.id, of_post, Post.published == True)
+                )
+            )
+            return list({path for (path,) in own.all()} | {path for (path,) in shared.all()})
+
+    @db_call
+    async def cleanup_old_posts(self, days: int = 3, chunk_size: int = 500):
+        """Удаляет неопубликованные посты старше указанного количества дней"""
+        total = 0
+        while True:
+            deleted, media_files = await self.delete_expired_posts(days, chunk_size)
+            await self.remove_files(media_files)
+            total += deleted
+            if deleted < chunk_size:
+                break
+        print(f"🗑️ Удалено {total} старых неопубликованных постов")
+        return total
+
+    @db_call
+    async def count_unpublished(self, max_attempts: Optional[int] = None) -> int:
+        """Длина очереди публикации; с max_attempts - без постов, исчерпавших попытки"""
+        stmt = select(func.count()).select_from(Post).where(
+            Post.published == False,
+            Post.is_duplicate == False
+        )
+        if max_attempts is not None:
+            stmt = stmt.where(Post.publish_attempts < max_attempts)
+        async with self.async_session() as session:
+            result = await session.execute(stmt)
+            return result.scalar() or 0
+
+    async def collect_metrics(self):
+        """Обновляет gauge очереди публикации и пула соединений"""
+        BACKLOG.set(await self.count_unpublished())
+        pool = self.engine.pool
+        DB_POOL.set(pool.checkedout(), state="checked_out")
+        DB_POOL.set(pool.size(), state="size")
+        DB_POOL.set(pool.overflow(), state="overflow")
 
     async def close(self):
         await self.engine.dispose()
\ No newline at end of file
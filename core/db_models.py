@@ -1,4 +1,4 @@
-from sqlalchemy import String, Text, DateTime, func,Index, ForeignKeyConstraint, Boolean
+from sqlalchemy import String, Text, DateTime, func,Index, ForeignKeyConstraint, Boolean, BigInteger, ForeignKey, LargeBinary, JSON, text
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from typing import Optional, List
 from datetime import datetime, timezone
@@ -13,7 +13,11 @@ class Post(Base):
     post_id: Mapped[int]        = mapped_column(index=False)
     channel_name: Mapped[str]   = mapped_column(String(100), index=False)
     text: Mapped[Optional[str]] = mapped_column(Text())
+    # Форматирование в компактном виде (core/formatting.py); NULL - старые посты, где text в markdown
+    entities: Mapped[Optional[list]] = mapped_column(JSON)
     published: Mapped[bool]     = mapped_column(Boolean, default=False, index=True)
+    is_duplicate: Mapped[bool]  = mapped_column(Boolean, default=False, server_default="false")
+    publish_attempts: Mapped[int] = mapped_column(default=0, server_default="0")
     date: Mapped[datetime]      = mapped_column(DateTime(timezone=True), index=True)
     scraped_at: Mapped[datetime]= mapped_column(
         DateTime(timezone=True),
@@ -37,14 +41,47 @@ class Post(Base):
         return f"Post(id={self.id}, channel={self.channel_name}, post_id={self.post_id}, date={self.date})"
 
 
+class MediaBlob(Base):
+    __tablename__ = "media_blobs"
+
+    id: Mapped[int]                     = mapped_column(primary_key=True)
+    file_key: Mapped[str]               = mapped_column(String(100), unique=True)
+    content_hash: Mapped[Optional[str]] = mapped_column(String(64), index=True)
+    file_path: Mapped[str]              = mapped_column(String(511))
+    size: Mapped[int]                   = mapped_column(BigInteger, default=0)
+    ref_count: Mapped[int]              = mapped_column(default=0)
+    created_at: Mapped[datetime]        = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        default=lambda: datetime.now(timezone.utc)
+    )
+
+    def __repr__(self) -> str:
+        return f"MediaBlob(id={self.id}, key={self.file_key}, refs={self.ref_count}, path={self.file_path})"
+
+
 class Media(Base):
     __tablename__ = "media"
 
     id: Mapped[int]             = mapped_column(primary_key=True)
     post_id: Mapped[int]        = mapped_column(index=False)
     channel_name: Mapped[str]   = mapped_column(String(100), index=False)
+    # Дата поста: ключ секционирования media при POSTS_PARTITIONING
+    post_date: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True))
     media_type: Mapped[str]     = mapped_column(String(50))
-    file_path: Mapped[str] = mapped_column(String(511))
+    file_path: Mapped[Optional[str]] = mapped_column(String(511))
+    # Ссылка на исходный файл в Telegram для пересылки без скачивания
+    tg_message_id: Mapped[Optional[int]]      = mapped_column()
+    tg_kind: Mapped[Optional[str]]            = mapped_column(String(20))
+    tg_id: Mapped[Optional[int]]              = mapped_column(BigInteger)
+    tg_access_hash: Mapped[Optional[int]]     = mapped_column(BigInteger)
+    tg_file_reference: Mapped[Optional[bytes]] = mapped_column(LargeBinary)
+    # Аккаунт пула, получивший сообщение: ссылка действительна только в его сессии
+    tg_account: Mapped[Optional[str]]         = mapped_column(String(100))
+    blob_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("media_blobs.id", ondelete="SET NULL"),
+        index=True
+    )
 
     __table_args__ = (
         ForeignKeyConstraint(
@@ -63,3 +100,95 @@ class Media(Base):
 
     def __repr__(self):
         return f"Media(id={self.id}, type={self.media_type}, channel_name={self.channel_name} post_id={self.post_id})"
+
+
+class ChannelCursor(Base):
+    __tablename__ = "channel_cursors"
+
+    channel_name: Mapped[str]    = mapped_column(String(100), primary_key=True)
+    last_message_id: Mapped[int] = mapped_column()
+    # Пропуск, оставленный без SCRAPE_BACKFILL: сообщения строго между
+    # gap_from и gap_to не получены, их дозаполнит включённый backfill
+    gap_from: Mapped[Optional[int]] = mapped_column()
+    gap_to: Mapped[Optional[int]]   = mapped_column()
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        default=lambda: datetime.now(timezone.utc)
+    )
+
+    def __repr__(self) -> str:
+        return f"ChannelCursor(channel={self.channel_name}, last_message_id={self.last_message_id})"
+
+
+class ResolvedPeer(Base):
+    """Кэш username -> peer: резолв username у Telegram сильно ограничен по частоте.
+
+    access_hash у каждого аккаунта свой, поэтому ключ - (аккаунт, username)
+    """
+    __tablename__ = "resolved_peers"
+
+    account: Mapped[str]                 = mapped_column(String(100), primary_key=True)
+    username: Mapped[str]                = mapped_column(String(100), primary_key=True)
+    peer_type: Mapped[str]               = mapped_column(String(20))
+    peer_id: Mapped[int]                 = mapped_column(BigInteger)
+    access_hash: Mapped[Optional[int]]   = mapped_column(BigInteger, nullable=True)
+    updated_at: Mapped[datetime]         = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        default=lambda: datetime.now(timezone.utc)
+    )
+
+    def __repr__(self) -> str:
+        return f"ResolvedPeer(account={self.account}, username={self.username}, type={self.peer_type}, peer_id={self.peer_id})"
+
+
+class JobLease(Base):
+    """Задание (парсинг канала, публикация в цель), которое воркер берёт в аренду"""
+    __tablename__ = "job_leases"
+
+    kind: Mapped[str]                    = mapped_column(String(20), primary_key=True)
+    name: Mapped[str]                    = mapped_column(String(100), primary_key=True)
+    owner: Mapped[Optional[str]]         = mapped_column(String(100), nullable=True)
+    lease_until: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    next_run_at: Mapped[datetime]        = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        default=lambda: datetime.now(timezone.utc)
+    )
+
+    __table_args__ = (
+        Index("ix_job_leases_due", "kind", "next_run_at"),
+    )
+
+    def __repr__(self) -> str:
+        return f"JobLease(kind={self.kind}, name={self.name}, owner={self.owner}, lease_until={self.lease_until})"
+
+
+class PublishOutbox(Base):
+    """Журнал результатов отправки: пишется сразу после send, а флаг
+    Post.published проставляется из него пачками"""
+    __tablename__ = "publish_outbox"
+
+    id: Mapped[int]              = mapped_column(primary_key=True)
+    post_id: Mapped[int]         = mapped_column()
+    channel_name: Mapped[str]    = mapped_column(String(100))
+    target: Mapped[str]          = mapped_column(String(100))
+    status: Mapped[str]          = mapped_column(String(20))
+    applied: Mapped[bool]        = mapped_column(Boolean, default=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        default=lambda: datetime.now(timezone.utc)
+    )
+
+    __table_args__ = (
+        Index("ix_outbox_post", "channel_name", "post_id"),
+        Index(
+            "ix_outbox_unapplied", "id",
+            postgresql_where=text("applied = false AND status = 'sent'")
+        ),
+    )
+
+    def __repr__(self) -> str:
+        return f"PublishOutbox(id={self.id}, channel={self.channel_name}, post_id={self.post_id}, status={self.status})"
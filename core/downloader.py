@@ -0,0 +1,349 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+import asyncio
+import os
+import time
+
+from telethon import errors
+
+from .albums import MessageRecord
+from .client import Account, ClientPool, BAN_ERRORS
+from .storage import MediaStore
+from .metrics import tg_call, log_event, DOWNLOADED_BYTES
+
+
+# Докачка идёт частями этого размера: смещение в upload.getFile должно
+# быть кратно части и не пересекать границу мегабайта
+RESUME_CHUNK = 512 * 1024
+
+def media_type(message) -> str:
+    """Определяет тип медиа сообщения так же, как он хранится в Media.media_type"""
+    if message.photo:
+        return "photo"
+    if message.document:
+        mime_type = message.document.mime_type or "document"
+        if mime_type.startswith('video'):
+            return "video"
+        return mime_type.split("/")[-1]
+    return "unknown"
+
+
+def media_reference(message, account: Optional[Account] = None) -> dict:
+    """Ссылка на файл Telegram, по которой медиа можно отправить без скачивания.
+
+    account - аккаунт, получивший сообщение: другой сессии ссылка не подойдёт.
+    """
+    media = message.photo or message.document
+    if media is None:
+        return {'message_id': message.id}
+    return {
+        'message_id': message.id,
+        'account': account.name if account is not None else None,
+        'kind': 'photo' if message.photo else 'document',
+        'id': media.id,
+        'access_hash': media.access_hash,
+        'file_reference': media.file_reference,
+    }
+
+
+@dataclass
+class DownloadJob:
+    # MessageRecord, а не сообщение Telethon целиком
+    message: object
+    directory: Path
+    # Канал и аккаунт, получивший сообщение: ссылки на файл действительны только для него
+    channel: Optional[str] = None
+    account: Optional[Account] = None
+    result: list = field(default_factory=list)
+
+
+@dataclass
+class DownloadStats:
+    files: int = 0
+    skipped: int = 0
+    deduplicated: int = 0
+    failed: int = 0
+    bytes: int = 0
+    busy_seconds: float = 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.busy_seconds if self.busy_seconds else 0.0
+
+
+class MediaDownloader:
+    def __init__(self, client, workers: int = 4, max_concurrency: int = 8,
+                 max_file_size: Optional[int] = None, allowed_types: Optional[set] = None,
+                 store: Optional[MediaStore] = None, reference_only: bool = False,
+                 pool: Optional[ClientPool] = None):
+        # Скачивание идёт через наименее загруженный аккаунт пула
+        self.pool = pool or ClientPool.single(client)
+        self.store = store
+        # Только сохраняем ссылки на файлы Telegram, ничего не скачивая
+        self.reference_only = reference_only
+        self._inflight: dict[str, asyncio.Future] = {}
+        self.workers = max(1, workers)
+        # Общий лимит одновременных скачиваний для всех каналов
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self.max_file_size = max_file_size
+        self.allowed_types = allowed_types
+        self.stats = DownloadStats()
+        self._progress: dict[int, tuple[int, int]] = {}
+
+    @property
+    def progress(self) -> dict[int, tuple[int, int]]:
+        """Текущие скачивания: id сообщения -> (скачано байт, всего байт)"""
+        return dict(self._progress)
+
+    def _should_skip(self, message) -> Optional[str]:
+        mtype = media_type(message)
+        if self.allowed_types and mtype not in self.allowed_types:
+            return f"тип {mtype} отключён"
+        size = message.file_size
+        if self.max_file_size and size and size > self.max_file_size:
+            return f"размер {size / 1024 / 1024:.1f} МБ превышает лимит"
+        return None
+
+    async def download_many(self, jobs: list[DownloadJob],
+                            known_blobs: Optional[dict[str, dict]] = None) -> list[DownloadJob]:
+        """Скачивает медиа пулом воркеров, результат пишется в job.result.
+
+        known_blobs — уже сохранённые в хранилище файлы по ключу
+        MediaStore.file_key, такие медиа повторно не скачиваются.
+        """
+        if not jobs:
+            return jobs
+        known_blobs = known_blobs or {}
+
+        queue: asyncio.Queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+
+        batch_started = time.monotonic()
+        bytes_before = self.stats.bytes
+
+        async def worker():
+            while True:
+                try:
+                    job = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                await self._download(job, known_blobs)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(jobs)))))
+        for job in jobs:
+            for item in job.result:
+                item['ref'] = media_reference(job.message, job.account)
+
+        elapsed = time.monotonic() - batch_started
+        downloaded = self.stats.bytes - bytes_before
+        speed = downloaded / elapsed / 1024 / 1024 if elapsed else 0.0
+        print(f"📥 Скачано {len(jobs)} медиа, {downloaded / 1024 / 1024:.1f} МБ за {elapsed:.1f} с. "
+              f"({speed:.2f} МБ/с)")
+        log_event('download_batch', files=len(jobs), bytes=downloaded, elapsed=round(elapsed, 3))
+        return jobs
+
+    async def _download(self, job: DownloadJob, known_blobs: dict[str, dict]):
+        message = job.message
+        reason = self._should_skip(message)
+        if reason:
+            print(f"Пропускаем медиа сообщения {message.id}: {reason}")
+            self.stats.skipped += 1
+            return
+
+        if self.reference_only:
+            job.result.append({'type': media_type(message), 'file_path': None})
+            return
+
+        key = self.store.file_key(message) if self.store else None
+        if key is None:
+            await self._fetch(job, job.directory)
+            return
+
+        blob = known_blobs.get(key)
+        if blob and Path(blob['path']).exists():
+            self.stats.deduplicated += 1
+            job.result.append({'type': media_type(message), 'file_path': blob['path'], 'blob': blob})
+            return
+
+        # Один и тот же файл в нескольких постах батча скачиваем один раз
+        if key in self._inflight:
+            self.stats.deduplicated += 1
+            blob = await self._inflight[key]
+            if blob:
+                job.result.append({'type': media_type(message), 'file_path': blob['path'], 'blob': blob})
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        blob = None
+        try:
+            path = self.store.path_for(key, message)
+            expected_size = message.file_size
+            if path.exists() and expected_size and path.stat().st_size == expected_size:
+                self.stats.deduplicated += 1
+                job.result.append({'type': media_type(message), 'file_path': str(path)})
+            else:
+                await self._fetch(job, path)
+            if job.result:
+                path = Path(job.result[0]['file_path'])
+                blob = {
+                    'key': key,
+                    'path': str(path),
+                    'size': path.stat().st_size,
+                    'hash': await self.store.content_hash(path),
+                }
+                job.result[0]['blob'] = blob
+        finally:
+            future.set_result(blob)
+            del self._inflight[key]
+
+    async def _fetch(self, job: DownloadJob, target: Path):
+        message = job.message
+
+        def on_progress(current, total):
+            self._progress[message.id] = (current, total)
+
+        async with self._semaphore:
+            started = time.monotonic()
+            try:
+                directory = target if target == job.directory else target.parent
+                directory.mkdir(parents=True, exist_ok=True)
+                downloaded = await self._download_with_failover(
+                    message, target, on_progress, job.account, job.channel
+                )
+            except Exception as e:
+                print(f"Ошибка при скачивании медиа: {e}")
+                self.stats.failed += 1
+                return
+            finally:
+                self.stats.busy_seconds += time.monotonic() - started
+                self._progress.pop(message.id, None)
+
+        paths = downloaded if isinstance(downloaded, list) else [downloaded]
+        mtype = media_type(message)
+        for path in paths:
+            if not path:
+                continue
+            size = Path(path).stat().st_size
+            self.stats.files += 1
+            self.stats.bytes += size
+            DOWNLOADED_BYTES.inc(size, type=mtype)
+            job.result.append({
+                'type': mtype,
+                'file_path': str(path),
+            })
+
+    async def _download_with_failover(self, message, target: Path, on_progress,
+                                      account: Optional[Account] = None, channel: Optional[str] = None):
+        """Скачивает через аккаунт, получивший сообщение.
+
+        access_hash и file_reference медиа действительны только для сессии,
+        в которой сообщение получено. При FloodWait или бане этого аккаунта
+        сообщение перечитывается другим аккаунтом и скачивается уже им.
+        """
+        account = account or self.pool.primary
+        message_id = message.id
+        error = None
+        for attempt in range(self.pool.size):
+            if attempt:
+                if channel is None:
+                    break
+                account = self.pool.least_loaded()
+                message = await self._refetch(account, channel, message_id)
+                if message is None:
+                    raise RuntimeError(f"сообщение {channel}/{message_id} недоступно аккаунту {account.name}")
+            account.active_downloads += 1
+            try:
+                return await self._download_file(account, message, target, on_progress)
+            except errors.FloodWaitError as e:
+                self.pool.report_flood(account, e.seconds)
+                error = e
+            except BAN_ERRORS as e:
+                self.pool.report_ban(account, e)
+                error = e
+            finally:
+                account.active_downloads -= 1
+        raise error
+
+    async def _get_messages(self, account: Account, channel: str, ids):
+        peer = channel
+        if account.peers is not None:
+            peer = await account.peers.resolve(channel, throttle=account.throttle)
+        await account.throttle()
+        with tg_call('get_messages'):
+            return await account.client.get_messages(peer, ids=ids)
+
+    async def _refetch(self, account: Account, channel: str, message_id: int) -> Optional[MessageRecord]:
+        message = await self._get_messages(account, channel, message_id)
+        return MessageRecord.from_message(message) if message is not None else None
+
+    async def _download_file(self, account, message, target: Path, on_progress):
+        """Скачивает в target.part и только потом атомарно переименовывает.
+
+        Оборванный документ докачивается с места остановки, фото небольшие
+        и скачиваются заново. Без хранилища (target - папка) имя файла
+        выбирает Telethon, как и раньше.
+        """
+        thumb = -1 if hasattr(message.media, 'photo') else None
+        if target.is_dir():
+            with tg_call('download_media'):
+                return await account.client.download_media(
+                    message.media, file=target, thumb=thumb, progress_callback=on_progress
+                )
+
+        part = target.with_name(target.name + '.part')
+        if message.document is not None:
+            await self._download_document(account, message, part, on_progress)
+        else:
+            with tg_call('download_media'):
+                await account.client.download_media(
+                    message.media, file=part, thumb=thumb, progress_callback=on_progress
+                )
+        os.replace(part, target)
+        return str(target)
+
+    async def _download_document(self, account, message, part: Path, on_progress):
+        size = message.file_size
+        offset = part.stat().st_size if part.exists() else 0
+        if size and offset > size:
+            offset = 0
+        offset -= offset % RESUME_CHUNK
+        if offset:
+            print(f"📥 Докачиваем {part.name[:-len('.part')]} с {offset / 1024 / 1024:.1f} МБ")
+
+        with open(part, 'r+b' if offset else 'wb') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            with tg_call('download_media'):
+                async for chunk in account.client.iter_download(
+                    message.document, offset=offset, request_size=RESUME_CHUNK, file_size=size
+                ):
+                    await asyncio.to_thread(f.write, chunk)
+                    offset += len(chunk)
+                    on_progress(offset, size)
+
+    async def restore(self, channel: str, files: dict[int, str]) -> int:
+        """Заново скачивает пропавшие файлы: id сообщения -> путь в хранилище.
+
+        Сообщения перечитываются из канала, так как ссылки на файлы
+        Telegram со временем устаревают. Возвращает число восстановленных.
+        """
+        account = self.pool.account_for(channel)
+        messages = await self._get_messages(account, channel, list(files))
+
+        restored = 0
+        for message in messages:
+            if message is None or not (message.photo or message.document):
+                continue
+            message = MessageRecord.from_message(message)
+            target = Path(files[message.id])
+            try:
+                async with self._semaphore:
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    await self._download_with_failover(message, target, lambda *_: None, account, channel)
+                restored += 1
+            except Exception as e:
+                print(f"❌ Не удалось восстановить {target}: {e}")
+        return restored
@@ -0,0 +1,125 @@
+from typing import Optional
+
+from telethon.helpers import add_surrogate, del_surrogate, strip_text
+from telethon.tl import types
+
+
+# Не переносим: упоминание по id требует InputUser с access_hash нашего
+# аккаунта, кастомные эмодзи - Premium; их текст остаётся в сообщении
+SKIPPED_ENTITIES = {'MessageEntityMentionName', 'MessageEntityCustomEmoji', 'MessageEntityUnknown'}
+
+PREFIX = 'MessageEntity'
+
+
+def pack_entities(entities) -> list:
+    """Entities сообщения в компактный JSON: [тип, offset, length, {прочие поля}]"""
+    packed = []
+    for entity in entities or ():
+        data = entity.to_dict()
+        name = data.pop('_')
+        if name in SKIPPED_ENTITIES or not name.startswith(PREFIX):
+            continue
+        item = [name[len(PREFIX):], data.pop('offset'), data.pop('length')]
+        extra = {key: value for key, value in data.items() if value is not None}
+        if extra:
+            item.append(extra)
+        packed.append(item)
+    return packed
+
+
+def unpack_entities(packed: Optional[list]) -> list:
+    entities = []
+    for name, offset, length, *extra in packed or ():
+        cls = getattr(types, PREFIX + name, None)
+        if cls is None:
+            continue
+        entities.append(cls(offset=offset, length=length, **(extra[0] if extra else {})))
+    return entities
+
+
+def utf16_len(text: str) -> int:
+    """Длина в UTF-16 - в этих единицах Telegram считает offset и лимиты"""
+    return len(add_surrogate(text))
+
+
+def _copy(entity, **changes):
+    data = entity.to_dict()
+    del data['_']
+    data.update(changes)
+    return entity.__class__(**data)
+
+
+def _strip(surrogated: str, entities: list) -> tuple[str, list]:
+    entities = [_copy(entity) for entity in entities]
+    return del_surrogate(strip_text(surrogated, entities)), entities
+
+
+def join_texts(parts: list[tuple[str, list]], separator: str = "\n\n") -> tuple[str, list]:
+    """Склеивает тексты сообщений альбома, сдвигая их entities"""
+    texts = []
+    entities = []
+    offset = 0
+    for text, part_entities in parts:
+        text, part_entities = _strip(add_surrogate(text or ''), part_entities or [])
+        if not text:
+            continue
+        if texts:
+            offset += utf16_len(separator)
+        entities.extend(_copy(entity, offset=entity.offset + offset) for entity in part_entities)
+        texts.append(text)
+        offset += utf16_len(text)
+    return separator.join(texts), entities
+
+
+def _split_position(surrogated: str, limit: int) -> int:
+    # Сначала режем по абзацу, потом по слову, но не раньше середины лимита
+    for separator in ('\n', ' '):
+        position = surrogated.rfind(separator, 0, limit)
+        if position > limit // 2:
+            return position + 1
+    # Не разрываем суррогатную пару (эмодзи и прочие символы вне BMP)
+    if '\ud800' <= surrogated[limit - 1] <= '\udbff':
+        return limit - 1
+    return limit
+
+
+def cut_text(text: str, entities: list, limit: int) -> tuple[str, list, str, list]:
+    """Делит текст не дальше limit единиц UTF-16: (начало, его entities, остаток, его entities).
+
+    Entities на границе разрезаются на две части, offset остатка сдвигается.
+    """
+    surrogated = add_surrogate(text)
+    if len(surrogated) <= limit:
+        return text, entities, '', []
+
+    position = _split_position(surrogated, limit)
+    head_entities = []
+    tail_entities = []
+    for entity in entities:
+        end = entity.offset + entity.length
+        if entity.offset < position:
+            head_entities.append(_copy(entity, length=min(end, position) - entity.offset))
+        if end > position:
+            start = max(entity.offset, position)
+            tail_entities.append(_copy(entity, offset=start - position, length=end - start))
+
+    head, head_entities = _strip(surrogated[:position], head_entities)
+    tail, tail_entities = _strip(surrogated[position:], tail_entities)
+    return head, head_entities, tail, tail_entities
+
+
+def split_text(text: str, entities: list, limit: int) -> list[tuple[str, list]]:
+    """Текст на части не длиннее limit, каждая со своими entities"""
+    chunks = []
+    while True:
+        head, head_entities, text, entities = cut_text(text, entities, limit)
+        chunks.append((head, head_entities))
+        if not text:
+            return chunks
+
+
+def truncate_text(text: str, entities: list, limit: int, ellipsis: str = '…') -> tuple[str, list]:
+    if utf16_len(text) <= limit:
+        return text, entities
+    head, head_entities, _, _ = cut_text(text, entities, limit - utf16_len(ellipsis))
+    return head + ellipsis, head_entities
@@ -0,0 +1,78 @@
+from typing import Optional
+import asyncio
+import os
+import socket
+
+from .db_manager import DBManager
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class JobQueue:
+    """Задания, которые несколько воркеров делят через аренду в БД.
+
+    'scrape' - по заданию на канал, 'publish' - по заданию на целевой
+    канал, так что публиковать в него может только один воркер. Пока
+    задание у воркера, keep_alive продлевает аренду; если воркер упал,
+    аренда истекает и задание забирает другой.
+
+    Медиа скачивает тот воркер, что парсил канал. Без общей папки media/
+    (MEDIA_SHARED=0) публикатор скачивает недостающие файлы заново.
+    """
+
+    def __init__(self, db: DBManager, worker_id: Optional[str] = None, lease_seconds: float = 300):
+        self.db = db
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self._names: dict[str, list[str]] = {}
+        self._held: dict[str, set[str]] = {}
+
+    async def register(self, kind: str, names: list[str]):
+        self._names[kind] = list(names)
+        self._held.setdefault(kind, set())
+        await self.db.ensure_jobs(kind, names)
+
+    async def claim(self, kind: str, limit: Optional[int] = None) -> list[str]:
+        names = self._names.get(kind, [])
+        if not names:
+            return []
+        claimed = await self.db.claim_jobs(
+            kind, names, self.worker_id, limit or len(names), self.lease_seconds
+        )
+        self._held[kind].update(claimed)
+        return claimed
+
+    def holds(self, kind: str, name: str) -> bool:
+        return name in self._held.get(kind, ())
+
+    def held(self, kind: str) -> set[str]:
+        return set(self._held.get(kind, ()))
+
+    async def release(self, kind: str, names: list[str], next_run_in: float = 0):
+        names = [name for name in names if name in self._held.get(kind, ())]
+        self._held[kind].difference_update(names)
+        await self.db.release_jobs(kind, names, self.worker_id, next_run_in)
+
+    async def keep_alive(self):
+        """Продлевает аренду взятых заданий, пока воркер жив"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            # register и claim могут менять _held, пока ждём БД
+            for kind, held in list(self._held.items()):
+                names = list(held)
+                if not names:
+                    continue
+                try:
+                    renewed = await self.db.renew_leases(kind, names, self.worker_id, self.lease_seconds)
+                except Exception as e:
+                    print(f"❌ Не удалось продлить аренду заданий {kind}: {e}")
+                    continue
+                # Задания, взятые за время запроса, продлевать было не нужно,
+                # а отпущенные уже не наши
+                lost = (set(names) - renewed) & held
+                if lost:
+                    # Аренду успели забрать: эти задания больше не наши
+                    print(f"⚠️ Потеряна аренда заданий {kind}: {', '.join(sorted(lost))}")
+                    held.difference_update(lost)
@@ -0,0 +1,228 @@
+"""Метрики в формате Prometheus и структурированные JSON-логи.
+
+Реестр держит счётчики, гистограммы и gauge в памяти процесса и отдаёт их
+по HTTP (/metrics). Gauge, которым нужен запрос к БД, считаются через
+асинхронные коллекторы в момент опроса.
+"""
+from typing import Awaitable, Callable, Optional
+import asyncio
+import functools
+import json
+import logging
+import time
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: Optional[dict] = None) -> str:
+    items = list(key) + list((extra or {}).items())
+    if not items:
+        return ""
+    body = ",".join(f'{name}="{str(value).replace(chr(34), chr(39))}"' for name, value in items)
+    return "{" + body + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels_key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[_labels_key(labels)] = value
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{_format_labels(key)} {value}" for key, value in self._values.items()]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(labels)
+        series = self._series.get(key)
+        if series is None:
+            # [счётчики по корзинам..., сумма, количество]
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, series in self._series.items():
+            for i, bound in enumerate(self.buckets):
+                lines.append(f"{self.name}_bucket{_format_labels(key, {'le': bound})} {series[i]}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, object] = {}
+        self._collectors: list[Callable[[], Awaitable[None]]] = []
+
+    def _register(self, metric):
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._register(Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self._register(Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, buckets))
+
+    def add_collector(self, collector: Callable[[], Awaitable[None]]):
+        """Коллектор обновляет gauge перед каждым опросом /metrics"""
+        self._collectors.append(collector)
+
+    async def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                await asyncio.wait_for(collector(), timeout=5)
+            except Exception as e:
+                print(f"Ошибка сбора метрик: {e}")
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+TG_REQUESTS = REGISTRY.counter("tg_requests_total", "Запросы к Telegram по методу и результату")
+TG_LATENCY = REGISTRY.histogram("tg_request_seconds", "Длительность запросов к Telegram")
+DB_CALLS = REGISTRY.counter("db_calls_total", "Вызовы DBManager по операции и результату")
+DB_LATENCY = REGISTRY.histogram("db_call_seconds", "Длительность вызовов DBManager")
+DOWNLOADED_BYTES = REGISTRY.counter("media_downloaded_bytes_total", "Скачано байт медиа")
+POSTS_SCRAPED = REGISTRY.counter("posts_scraped_total", "Новые посты по каналам")
+POSTS_PUBLISHED = REGISTRY.counter("posts_published_total", "Опубликованные посты")
+BACKLOG = REGISTRY.gauge("publish_backlog_posts", "Неопубликованные посты в очереди")
+DB_POOL = REGISTRY.gauge("db_pool_connections", "Соединения пула SQLAlchemy")
+
+
+class timed:
+    """Контекстный менеджер: пишет длительность и результат в гистограмму и счётчик"""
+
+    def __init__(self, histogram: Histogram, counter: Counter, **labels):
+        self.histogram = histogram
+        self.counter = counter
+        self.labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self._started, **self.labels)
+        self.counter.inc(status="error" if exc_type else "ok", **self.labels)
+        return False
+
+
+def tg_call(method: str) -> timed:
+    return timed(TG_LATENCY, TG_REQUESTS, method=method)
+
+
+def db_call(func):
+    """Декоратор для методов DBManager: время и число вызовов по имени метода"""
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with timed(DB_LATENCY, DB_CALLS, operation=func.__name__):
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+async def _handle_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request_line.decode(errors="replace").split(" ")[1] if request_line else ""
+        if path.split("?")[0] == "/metrics":
+            body = (await REGISTRY.render()).encode()
+            status = "200 OK"
+        else:
+            body = b"not found\n"
+            status = "404 Not Found"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except Exception as e:
+        print(f"Ошибка HTTP-эндпоинта метрик: {e}")
+    finally:
+        writer.close()
+
+
+async def start_http_server(port: int, host: str = "127.0.0.1") -> asyncio.AbstractServer:
+    server = await asyncio.start_server(_handle_http, host, port)
+    print(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+    return server
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'event': record.getMessage(),
+        }
+        payload.update(getattr(record, 'fields', {}))
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+logger = logging.getLogger("tg_scraper")
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+
+def setup_json_logging(level: int = logging.INFO):
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+
+
+def log_event(event: str, **fields):
+    """Структурированное событие; выводится, только если включены JSON-логи"""
+    logger.info(event, extra={'fields': fields})
@@ -0,0 +1,108 @@
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Optional
+import asyncio
+
+from telethon import errors, utils
+from telethon.tl import types
+
+from .metrics import tg_call
+
+
+# Ошибки, после которых сохранённый peer считаем устаревшим:
+# канал удалён или закрыт, username сменился или освободился
+PEER_ERRORS = (
+    errors.ChannelInvalidError,
+    errors.ChannelPrivateError,
+    errors.PeerIdInvalidError,
+    errors.UsernameInvalidError,
+    errors.UsernameNotOccupiedError,
+)
+
+
+class PeerCache:
+    """Резолвит username в InputPeer через кэш в памяти и в БД.
+
+    ResolveUsername - один из самых жёстко ограниченных методов Telegram,
+    поэтому к нему обращаемся только при первом появлении канала, по
+    истечении ttl и после ошибок из PEER_ERRORS (invalidate).
+    """
+
+    def __init__(self, client, db, ttl: float = 7 * 24 * 3600, account: str = "default"):
+        self.client = client
+        self.db = db
+        # access_hash действителен только для аккаунта, который его получил
+        self.account = account
+        self.ttl = ttl
+        self._peers: dict[str, tuple[object, float]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def normalize(username: str) -> str:
+        username = username.strip()
+        for prefix in ('https://', 'http://', 't.me/', '@'):
+            if username.lower().startswith(prefix):
+                username = username[len(prefix):]
+        return username.lower()
+
+    async def resolve(self, username: str, throttle: Optional[Callable[[], Awaitable]] = None):
+        """Возвращает InputPeer; throttle вызывается только перед запросом к Telegram"""
+        key = self.normalize(username)
+        if key == 'me' or key.lstrip('-').isdigit():
+            return username
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            cached = self._peers.get(key)
+            if cached is not None and self._is_fresh(cached[1]):
+                return cached[0]
+
+            row = await self.db.get_peer(self.account, key)
+            if row is not None:
+                updated_at = row['updated_at']
+                if updated_at.tzinfo is None:
+                    updated_at = updated_at.replace(tzinfo=timezone.utc)
+                if self._is_fresh(updated_at.timestamp()):
+                    peer = self._to_input_peer(row['peer_type'], row['peer_id'], row['access_hash'])
+                    self._peers[key] = (peer, updated_at.timestamp())
+                    return peer
+
+            if throttle is not None:
+                await throttle()
+            with tg_call('resolve_username'):
+                entity = await self.client.get_entity(key)
+            peer_type, peer_id, access_hash = self._from_entity(entity)
+            if row is not None and row['peer_id'] != peer_id:
+                print(f"⚠️ Username @{key} теперь указывает на другой канал ({row['peer_id']} -> {peer_id})")
+            await self.db.save_peer(self.account, key, peer_type, peer_id, access_hash)
+            peer = self._to_input_peer(peer_type, peer_id, access_hash)
+            self._peers[key] = (peer, datetime.now(timezone.utc).timestamp())
+            return peer
+
+    async def invalidate(self, username: str):
+        """Забывает peer, следующий resolve снова спросит Telegram"""
+        key = self.normalize(username)
+        self._peers.pop(key, None)
+        await self.db.delete_peer(self.account, key)
+        print(f"🔄 Кэш peer для @{key} сброшен")
+
+    def _is_fresh(self, updated_at: float) -> bool:
+        return datetime.now(timezone.utc).timestamp() - updated_at < self.ttl
+
+    @staticmethod
+    def _from_entity(entity) -> tuple[str, int, Optional[int]]:
+        peer = utils.get_input_peer(entity)
+        if isinstance(peer, types.InputPeerChannel):
+            return 'channel', peer.channel_id, peer.access_hash
+        if isinstance(peer, types.InputPeerUser):
+            return 'user', peer.user_id, peer.access_hash
+        if isinstance(peer, types.InputPeerChat):
+            return 'chat', peer.chat_id, None
+        raise ValueError(f"неподдерживаемый тип peer: {type(peer).__name__}")
+
+    @staticmethod
+    def _to_input_peer(peer_type: str, peer_id: int, access_hash: Optional[int]):
+        if peer_type == 'channel':
+            return types.InputPeerChannel(peer_id, access_hash)
+        if peer_type == 'user':
+            return types.InputPeerUser(peer_id, access_hash)
+        return types.InputPeerChat(peer_id)
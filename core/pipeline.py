@@ -0,0 +1,60 @@
+from typing import Optional
+import asyncio
+import time
+
+from .db_manager import DBManager
+
+
+class PublishQueue:
+    """Связь парсинга и публикации, работающих одновременно.
+
+    Сама очередь - неопубликованные посты в БД, так что она переживает
+    перезапуск. Парсер после каждой сохранённой страницы будит публикатор
+    (notify), а перед запросом следующей ждёт, пока очередь не станет
+    короче limit (wait_for_room). limit = 0 отключает backpressure.
+    """
+
+    def __init__(self, db: DBManager, limit: int = 0, max_attempts: Optional[int] = None,
+                 check_interval: float = 5):
+        self.db = db
+        self.limit = limit
+        # Посты, исчерпавшие попытки, публикатор уже не возьмёт: в очередь их не считаем
+        self.max_attempts = max_attempts
+        self.check_interval = check_interval
+        self._ready = asyncio.Event()
+        self._backlog = 0
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def notify(self):
+        self._ready.set()
+
+    async def wait_for_posts(self, timeout: float):
+        """Ждёт новых постов от парсера, но не дольше timeout"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._ready.clear()
+
+    async def backlog(self) -> int:
+        # Длину очереди спрашиваем у БД не чаще раза в check_interval на все каналы
+        async with self._lock:
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                self._backlog = await self.db.count_unpublished(self.max_attempts)
+                self._checked_at = time.monotonic()
+            return self._backlog
+
+    async def wait_for_room(self):
+        if not self.limit:
+            return
+        announced = False
+        while (backlog := await self.backlog()) >= self.limit:
+            if not announced:
+                print(f"⏸️ В очереди публикации {backlog} постов (лимит {self.limit}), парсинг приостановлен")
+                announced = True
+            # Публикатор мог заснуть до следующего таймера: будим его
+            self.notify()
+            await asyncio.sleep(self.check_interval)
+        if announced:
+            print(f"▶️ Очередь публикации сократилась до {backlog}, парсинг продолжается")
@@ -1,106 +1,428 @@
-from telethon import TelegramClient
+from telethon import TelegramClient, errors
+from telethon.tl import types
+from telethon.extensions import markdown
 from sqlalchemy.future import select
+from sqlalchemy import tuple_, exists
 from sqlalchemy.orm import selectinload
 from core.db_manager import DBManager
-from core.db_models import Post, Media
+from core.db_models import Post, Media, PublishOutbox
+from core.storage import MediaStore
+from core.rate_limit import TokenBucket
+from core.peers import PeerCache, PEER_ERRORS
+from core.jobs import JobQueue
+from core.recompress import MediaCompressor
+from core.formatting import unpack_entities, utf16_len, split_text, cut_text, truncate_text
+from core.metrics import tg_call, timed, log_event, DB_LATENCY, DB_CALLS, POSTS_PUBLISHED
+from collections import deque
 from pathlib import Path
+from typing import Optional
 import asyncio
 import os
+import shutil
+import time
+
+# Ошибки, после которых сохранённая ссылка на медиа считается недействительной
+REFERENCE_ERRORS = (
+    errors.FileReferenceExpiredError,
+    errors.FileReferenceInvalidError,
+    errors.FileReferenceEmptyError,
+    errors.MediaEmptyError,
+    errors.ChatForwardsRestrictedError,
+)
 
 
 class PostPublisher:
-    def __init__(self, client: TelegramClient, db_manager: DBManager, target_channel: str, post_delay):
+    def __init__(self, client: TelegramClient, db_manager: DBManager, target_channel: str,
+                 rate_per_minute: float = 20, burst: int = 3,
+                 rate_limits: dict[str, tuple[float, int]] = None,
+                 max_attempts: int = 5, max_flood_retries: int = 3,
+                 page_size: int = 100, media_mode: str = 'download',
+                 flush_every: int = 20, flush_interval: float = 10,
+                 store: MediaStore = None, peers: PeerCache = None,
+                 jobs: JobQueue = None, compressor: MediaCompressor = None,
+                 channels_refresh_interval: float = 10, caption_overflow: str = 'truncate',
+                 account_name: Optional[str] = None):
         self.client = client
+        # Имя аккаунта client в пуле: чужие ссылки на медиа перечитываем через него
+        self.account_name = account_name
+        # Необязательное пережатие скачанных медиа перед загрузкой
+        self.compressor = compressor
+        # При нескольких воркерах публикует только тот, у кого аренда цели
+        self.jobs = jobs
+        self.peers = peers or PeerCache(client, db_manager)
+        self.store = store or MediaStore()
         self.db_manager = db_manager
         self.target_channel = target_channel
-        self.post_delay = post_delay
         self.max_caption_length = 1024
+        self.max_message_length = 4096
+        # Текст длиннее лимита: 'truncate' - обрезать, 'split' - остаток отдельными сообщениями
+        self.caption_overflow = caption_overflow
+        # Лимиты по целям: {канал: (постов в минуту, всплеск)}
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.rate_limits = rate_limits or {}
+        self._buckets: dict[str, TokenBucket] = {}
+        self.max_attempts = max_attempts
+        self.max_flood_retries = max_flood_retries
+        self.page_size = page_size
+        self.channels_refresh_interval = channels_refresh_interval
+        # 'download' - публикуем скачанные файлы, 'reference' - пересылаем ссылки на медиа
+        self.media_mode = media_mode
+        # Отправленные посты, ждущие пакетной отметки published
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._sent: dict[tuple[str, int], Post] = {}
+        # Отправленные посты, которые не удалось записать в outbox: не
+        # отправляем их повторно и дописываем в outbox при следующем _flush
+        self._unrecorded: dict[tuple[str, int], Post] = {}
+        self._last_flush = time.monotonic()
+
+    def _bucket(self, target: str) -> TokenBucket:
+        if target not in self._buckets:
+            rate, burst = self.rate_limits.get(target, (self.rate_per_minute, self.burst))
+            self._buckets[target] = TokenBucket(rate / 60, burst)
+        return self._buckets[target]
 
     async def publish_posts(self):
-        posts = await self._get_unpublished_posts()
-        for post in reversed(posts):
-            try:
-                print(f"[PUBLISH] Публикую пост {post.post_id} из канала @{post.channel_name}")
-                success = await self._publish_post(post)
+        if self.jobs is not None and not await self.jobs.claim('publish'):
+            print(f"[SKIPPED] Публикацией в @{self.target_channel} занят другой воркер")
+            return
+        # Сначала применяем то, что было отправлено до перезапуска
+        await self._flush()
+        try:
+            async for post in self._iter_unpublished_posts():
+                if self.jobs is not None and not self.jobs.holds('publish', self.target_channel):
+                    print(f"[WARNING] Аренда публикации в @{self.target_channel} потеряна, останавливаемся")
+                    break
+                key = (post.channel_name, post.post_id)
+                if key in self._unrecorded:
+                    continue
+                try:
+                    print(f"[PUBLISH] Публикую пост {post.post_id} из канала @{post.channel_name}")
+                    success = await self._publish_with_retry(post)
 
-                if success:
-                    marked = await self.db_manager.mark_post_published(post.post_id, post.channel_name)
+                    if success:
+                        if not await self.db_manager.record_publish_result(
+                            post.post_id, post.channel_name, self.target_channel
+                        ):
+                            self._unrecorded[key] = post
+                            print(f"[ERROR] Пост {post.post_id} отправлен, но не записан в outbox, "
+                                  f"публикация остановлена до восстановления БД")
+                            break
+                        self._sent[key] = post
+                        print(f"[SUCCESS] Пост {post.post_id} опубликован")
+                        POSTS_PUBLISHED.inc(source=post.channel_name)
+                        log_event('post_published', channel=post.channel_name, post_id=post.post_id)
+                        if self._should_flush():
+                            await self._flush()
+                    elif success is None:
+                        # Упёрлись во flood wait: пост не виноват, попытку не засчитываем
+                        print(f"[FLOOD] Пост {post.post_id} отложен: Telegram ограничивает отправку")
+                    else:
+                        attempts = await self.db_manager.increment_publish_attempts(post.post_id, post.channel_name)
+                        print(f"[WARNING] Пост {post.post_id} не опубликован (попытка {attempts}/{self.max_attempts})")
+                except Exception as e:
+                    print(f"[ERROR] Не удалось опубликовать пост {post.post_id}: {e}")
+        finally:
+            await self._flush()
+            if self.jobs is not None:
+                await self.jobs.release('publish', [self.target_channel])
 
-                    if marked:
-                        await self._cleanup_media(post)
-                        print(f"[SUCCESS] Пост {post.post_id} опубликован, медиа удалены")
-                else:
-                    print(f"[WARNING] Пост {post.post_id} не опубликован")
+    def _should_flush(self) -> bool:
+        return (
+            len(self._sent) >= self.flush_every
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        )
 
-                await asyncio.sleep(self.post_delay)
-            except Exception as e:
-                print(f"[ERROR] Не удалось опубликовать пост {post.post_id}: {e}")
-
-    async def _get_unpublished_posts(self) -> list[Post]:
-        async with self.db_manager.async_session() as session:
-            result = await session.execute(
-                select(Post)
-                .options(selectinload(Post.media))
-                .where(Post.published == False)
-                .order_by(Post.date.desc())
+    async def _flush(self):
+        """Одним запросом помечает отправленные посты опубликованными и чистит их медиа"""
+        self._last_flush = time.monotonic()
+        for key, post in list(self._unrecorded.items()):
+            if not await self.db_manager.record_publish_result(post.post_id, post.channel_name, self.target_channel):
+                break
+            self._sent[key] = self._unrecorded.pop(key)
+        flushed = await self.db_manager.flush_published()
+        for key in flushed:
+            post = self._sent.pop(key, None)
+            if post is not None:
+                await self._cleanup_media(post)
+        if flushed:
+            print(f"[FLUSH] Отмечено опубликованными: {len(flushed)}")
+
+    async def _publish_with_retry(self, post: Post) -> Optional[bool]:
+        """None - все max_flood_retries попыток упёрлись во flood wait"""
+        bucket = self._bucket(self.target_channel)
+        for _ in range(self.max_flood_retries):
+            try:
+                success = await self._publish_post(post, bucket)
+            except (errors.FloodWaitError, errors.SlowModeWaitError) as e:
+                # Ждём ровно столько, сколько сказал сервер, попытку не засчитываем
+                print(f"[FLOOD] Telegram просит подождать {e.seconds} с.")
+                bucket.on_flood_wait(e.seconds)
+                continue
+            if success:
+                bucket.on_success()
+            return success
+        return None
+
+    def _unpublished(self, stmt):
+        return stmt.where(
+            Post.published == False,
+            Post.is_duplicate == False,
+            Post.publish_attempts < self.max_attempts,
+            ~exists().where(
+                PublishOutbox.channel_name == Post.channel_name,
+                PublishOutbox.post_id == Post.post_id,
+                PublishOutbox.status == 'sent'
             )
-            return result.scalars().all()
+        )
 
-    async def _publish_post(self, post: Post) -> bool:
-        media_files = []
-        for media in post.media:
-            media_path = Path(media.file_path)
-            if media_path.exists():
-                media_files.append(media_path)
+    async def _iter_unpublished_posts(self):
+        """Отдаёт очередь на публикацию по кругу по каналам-источникам.
+
+        За один круг из каждого канала берётся по одному посту, начиная с
+        канала с самым старым постом, так что активный канал не задерживает
+        остальные. Внутри канала - от старых к новым, страницами по (date, id).
+        Каналы, в которых посты появились во время прохода, подключаются
+        к кругу раз в channels_refresh_interval.
+        """
+        buffers: dict[str, deque] = {}
+        last_keys: dict[str, tuple] = {}
+        refreshed_at = None
+        while True:
+            if refreshed_at is None or time.monotonic() - refreshed_at >= self.channels_refresh_interval:
+                for channel in await self._pending_channels():
+                    buffers.setdefault(channel, deque())
+                refreshed_at = time.monotonic()
+
+            for channel in list(buffers):
+                if buffers[channel]:
+                    continue
+                page = await self._fetch_page(channel, last_keys.get(channel))
+                if not page:
+                    del buffers[channel]
+                    continue
+                buffers[channel].extend(page)
+                last_keys[channel] = (page[-1].date, page[-1].id)
+            if not buffers:
+                return
+
+            for channel in sorted(buffers, key=lambda name: (buffers[name][0].date, buffers[name][0].id)):
+                yield buffers[channel].popleft()
+
+    async def _pending_channels(self) -> list[str]:
+        with timed(DB_LATENCY, DB_CALLS, operation='fetch_unpublished_channels'):
+            async with self.db_manager.async_session() as session:
+                result = await session.execute(self._unpublished(select(Post.channel_name).distinct()))
+                return result.scalars().all()
+
+    async def _fetch_page(self, channel: str, last_key: Optional[tuple]) -> list[Post]:
+        stmt = (
+            self._unpublished(select(Post).options(selectinload(Post.media)))
+            .where(Post.channel_name == channel)
+            .order_by(Post.date.asc(), Post.id.asc())
+            .limit(self.page_size)
+        )
+        if last_key is not None:
+            stmt = stmt.where(tuple_(Post.date, Post.id) > last_key)
+
+        with timed(DB_LATENCY, DB_CALLS, operation='fetch_unpublished_page'):
+            async with self.db_manager.async_session() as session:
+                return (await session.execute(stmt)).scalars().all()
+
+    async def _publish_post(self, post: Post, bucket: TokenBucket) -> bool:
+        # Файлов нет на этом воркере (скачаны в media/ другого контейнера или
+        # пропали): берём медиа из Telegram, а не публикуем один текст
+        refetch = False
+        if self.media_mode == 'reference':
+            if self._foreign_references(post):
+                try:
+                    media_files = await self._refetch_references(post)
+                except (errors.FloodWaitError, errors.SlowModeWaitError):
+                    raise
+                except Exception as e:
+                    print(f"[ERROR] Не удалось перечитать медиа поста {post.post_id}: {e}")
+                    return False
             else:
-                print(f"[WARNING] Медиафайл не найден: {media_path}")
+                media_files = self._media_references(post)
+        else:
+            media_files, missing = self._local_media(post)
+            if missing and any(media.tg_message_id for media in post.media):
+                print(f"[WARNING] Не все медиафайлы поста {post.post_id} есть локально, "
+                      f"скачиваем их заново из Telegram")
+                media_files, refetch = [], True
+            elif self.compressor is not None and media_files:
+                media_files = await self.compressor.prepare(media_files)
 
         try:
-            if not media_files and not post.text.strip():
+            if not media_files and not refetch and not post.text.strip():
                 print(f"[SKIPPED] Пост {post.post_id} не содержит контента")
                 return False
 
-            caption = self._process_caption(post.text)
+            text, entities = self._post_text(post)
+            limit = self.max_caption_length if media_files or refetch else self.max_message_length
+            text, entities, overflow = self._fit_text(post, text, entities, limit)
+            target = await self.peers.resolve(self.target_channel)
+            await bucket.acquire()
 
-            if not media_files:
-                await self.client.send_message(
-                    self.target_channel,
-                    caption,
-                    parse_mode='md'
-                )
-                return True
+            if refetch:
+                await self._send_downloaded(target, post, text, entities)
+            elif not media_files:
+                await self._send_text(target, text, entities)
             else:
-                await self.client.send_file(
-                    self.target_channel,
-                    [str(f) for f in media_files],
-                    caption=caption if caption.strip() else None,
-                    parse_mode='md',
-                    force_document=False
-                )
-                return True
+                try:
+                    await self._send_media(target, media_files, text, entities)
+                except REFERENCE_ERRORS as e:
+                    if self.media_mode != 'reference':
+                        raise
+                    print(f"[WARNING] Ссылка на медиа поста {post.post_id} устарела ({e}), "
+                          f"скачиваем и загружаем заново")
+                    await self._send_downloaded(target, post, text, entities)
+            await self._send_overflow(target, post, overflow, bucket)
+            return True
+        except (errors.FloodWaitError, errors.SlowModeWaitError):
+            raise
+        except PEER_ERRORS as e:
+            print(f"[ERROR] Канал @{self.target_channel} недоступен ({e}), peer будет получен заново")
+            await self.peers.invalidate(self.target_channel)
+            return False
         except Exception as e:
             print(f"[ERROR] Ошибка публикации: {e}")
             return False
 
-    def _process_caption(self, text: str) -> str:
-        if len(text) > self.max_caption_length:
-            print(f'Пост был обрезан до длины в {max_caption_length}')
-            return text[:self.max_caption_length - 3] + "..."
-        return text
+    def _post_text(self, post: Post) -> tuple[str, list]:
+        if post.entities is None:
+            # Посты, сохранённые до появления entities: текст в markdown
+            return markdown.parse(post.text or '')
+        return post.text or '', unpack_entities(post.entities)
 
+    def _fit_text(self, post: Post, text: str, entities: list, limit: int) -> tuple[str, list, list]:
+        """Укладывает текст в limit (UTF-16); третье значение - части для отдельных сообщений"""
+        if utf16_len(text) <= limit:
+            return text, entities, []
+        if self.caption_overflow == 'split':
+            text, entities, rest, rest_entities = cut_text(text, entities, limit)
+            overflow = split_text(rest, rest_entities, self.max_message_length)
+            print(f"[CAPTION] Текст поста {post.post_id} длиннее {limit}, "
+                  f"продолжение уйдёт отдельно ({len(overflow)} сообщ.)")
+            return text, entities, overflow
+        print(f"[CAPTION] Текст поста {post.post_id} обрезан до {limit} символов")
+        text, entities = truncate_text(text, entities, limit)
+        return text, entities, []
 
-    async def _cleanup_media(self, post: Post):
-        for media in post.media:
+    async def _send_text(self, target, text: str, entities: list):
+        # Разметка уже в entities: parse_mode=None, чтобы текст не разбирался заново
+        with tg_call('send_message'):
+            await self.client.send_message(
+                target,
+                text,
+                formatting_entities=entities,
+                parse_mode=None
+            )
+
+    async def _send_overflow(self, target, post: Post, overflow: list, bucket: TokenBucket):
+        """Продолжение длинного поста. Сам пост уже отправлен, поэтому ошибка
+        здесь не должна приводить к повторной публикации"""
+        for text, entities in overflow:
             try:
-                media_path = Path(media.file_path)
-                if media_path.exists():
-                    media_path.unlink()
-                    print(f"Удален медиафайл: {media_path}")
-
-                # Удаляем пустые директории
-                media_dir = media_path.parent
-                if media_dir.exists() and not any(media_dir.iterdir()):
-                    media_dir.rmdir()
-                    print(f"Удалена пустая директория: {media_dir}")
+                await bucket.acquire()
+                await self._send_text(target, text, entities)
             except Exception as e:
-                print(f"Ошибка при удалении медиа: {e}")
\ No newline at end of file
+                print(f"[WARNING] Не удалось отправить продолжение поста {post.post_id}: {e}")
+                return
+
+    async def _send_media(self, target, media_files: list, caption: str, entities: list):
+        with tg_call('send_file'):
+            await self.client.send_file(
+                target,
+                media_files,
+                caption=caption if caption.strip() else None,
+                formatting_entities=entities,
+                parse_mode=None,
+                force_document=False
+            )
+
+    def _local_media(self, post: Post) -> tuple[list[str], bool]:
+        """Файлы поста на диске этого воркера; второе значение - часть файлов не найдена"""
+        media_files = []
+        missing = False
+        for media in post.media:
+            if not media.file_path:
+                continue
+            media_path = Path(media.file_path)
+            if media_path.exists():
+                media_files.append(str(media_path))
+            else:
+                print(f"[WARNING] Медиафайл не найден: {media_path}")
+                missing = True
+        return media_files, missing
+
+    def _media_references(self, post: Post) -> list:
+        """Медиа поста в виде ссылок на файлы Telegram, без скачивания"""
+        media_files = []
+        for media in post.media:
+            if media.tg_kind == 'photo':
+                media_files.append(types.InputPhoto(
+                    id=media.tg_id,
+                    access_hash=media.tg_access_hash,
+                    file_reference=media.tg_file_reference
+                ))
+            elif media.tg_kind == 'document':
+                media_files.append(types.InputDocument(
+                    id=media.tg_id,
+                    access_hash=media.tg_access_hash,
+                    file_reference=media.tg_file_reference
+                ))
+            elif media.file_path and Path(media.file_path).exists():
+                media_files.append(media.file_path)
+        return media_files
+
+    def _foreign_references(self, post: Post) -> bool:
+        return any(
+            media.tg_account is not None and media.tg_account != self.account_name
+            for media in post.media
+        )
+
+    async def _refetch_references(self, post: Post) -> list:
+        """Ссылки получены другим аккаунтом пула: перечитываем сообщения своим"""
+        message_ids = [media.tg_message_id for media in post.media if media.tg_message_id]
+        source = await self.peers.resolve(post.channel_name)
+        with tg_call('get_messages'):
+            messages = await self.client.get_messages(source, ids=message_ids)
+        media_files = [
+            message.photo or message.document
+            for message in messages
+            if message is not None and (message.photo or message.document)
+        ]
+        if not media_files:
+            raise RuntimeError("исходные медиа недоступны")
+        return media_files
+
+    async def _send_downloaded(self, target, post: Post, caption: str, entities: list):
+        """Запасной путь: заново получает исходные сообщения, скачивает и загружает медиа"""
+        message_ids = [media.tg_message_id for media in post.media if media.tg_message_id]
+        source = await self.peers.resolve(post.channel_name)
+        with tg_call('get_messages'):
+            messages = await self.client.get_messages(source, ids=message_ids)
+        tmp_dir = self.store.root.parent / "tmp" / f"{post.channel_name}_{post.post_id}"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            media_files = []
+            for message in messages:
+                if message is None or not message.media:
+                    continue
+                with tg_call('download_media'):
+                    path = await self.client.download_media(message, file=tmp_dir)
+                if path:
+                    media_files.append(path)
+            if not media_files:
+                raise RuntimeError("исходные медиа недоступны")
+            await self._send_media(target, media_files, caption, entities)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, tmp_dir, True)
+
+    async def _cleanup_media(self, post: Post):
+        # Общие файлы хранилища удаляются, только когда на них не осталось ссылок
+        shared = await self.db_manager.release_post_media(post.post_id, post.channel_name)
+        own = [media.file_path for media in post.media if media.blob_id is None and media.file_path]
+        await self.db_manager.remove_files(shared + own)
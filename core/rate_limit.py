@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов к одной цели (каналу).
+
+    rate — токенов в секунду, capacity — допустимый «всплеск». После
+    FloodWait ведро блокируется на время, указанное сервером, и снижает
+    скорость; успешные отправки постепенно возвращают её к настроенной.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1, min_rate_ratio: float = 0.25):
+        self.max_rate = rate
+        self.min_rate = rate * min_rate_ratio
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+    def on_flood_wait(self, seconds: float):
+        """Учитывает FloodWait: ждём сколько сказал сервер и сбавляем скорость"""
+        now = time.monotonic()
+        self._blocked_until = max(self._blocked_until, now + seconds)
+        self._tokens = 0
+        self._updated = now + seconds
+        self.rate = max(self.min_rate, self.rate * 0.5)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
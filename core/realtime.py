@@ -0,0 +1,89 @@
+from functools import partial
+from typing import Callable, Optional
+
+from telethon import events, functions, utils
+
+
+class RealtimeListener:
+    """Получает новые посты каналов через обновления Telegram, без опроса.
+
+    Сообщения идут тем же путём, что и при парсинге
+    (TGScraper.process_messages). Курсор канала здесь не сдвигается: его
+    двигает периодический опрос, который заодно подбирает сообщения,
+    пропущенные во время переподключений. Каждый канал слушает аккаунт,
+    за которым он закреплён в пуле.
+    """
+
+    def __init__(self, scraper, channels: list[str],
+                 on_new_posts: Optional[Callable[[], None]] = None,
+                 owns: Optional[Callable[[str], bool]] = None):
+        self.scraper = scraper
+        self.channels = channels
+        self.on_new_posts = on_new_posts
+        # При нескольких воркерах: обрабатывает ли этот воркер обновления канала
+        self.owns = owns
+        self._names: dict[int, str] = {}
+
+    async def start(self):
+        pool = self.scraper.pool
+        entities = {}
+        for channel_name in self.channels:
+            account = pool.account_for(channel_name)
+            try:
+                entity = await account.peers.resolve(channel_name, throttle=account.throttle)
+            except Exception as e:
+                print(f"❌ Канал @{channel_name} недоступен для real-time режима: {e}")
+                continue
+            if not await self._ensure_joined(account, channel_name, entity):
+                continue
+            self._names[utils.get_peer_id(entity)] = channel_name
+            entities.setdefault(account, []).append(entity)
+
+        for account, chats in entities.items():
+            # Медиа скачиваются тем аккаунтом, которому пришло обновление
+            account.client.add_event_handler(partial(self._on_message, account), events.NewMessage(chats=chats))
+            account.client.add_event_handler(partial(self._on_album, account), events.Album(chats=chats))
+        print(f"📡 Real-time режим: слушаем {sum(map(len, entities.values()))} каналов "
+              f"с {len(entities)} аккаунтов")
+
+    @staticmethod
+    async def _ensure_joined(account, channel_name: str, entity) -> bool:
+        """Обновления приходят только по каналам, в которых аккаунт состоит"""
+        try:
+            await account.throttle()
+            channel = await account.client.get_entity(entity)
+            if not getattr(channel, 'left', False):
+                return True
+            await account.throttle()
+            await account.client(functions.channels.JoinChannelRequest(channel))
+            print(f"➕ Аккаунт {account.name} вступил в @{channel_name} для real-time режима")
+            return True
+        except Exception as e:
+            print(f"⚠️ Аккаунт {account.name} не состоит в @{channel_name} и не смог вступить ({e}): "
+                  f"новые посты подберёт только периодический опрос")
+            return False
+
+    async def _on_message(self, account, event):
+        # Части альбомов приходят отдельно через events.Album
+        if event.message.grouped_id:
+            return
+        await self._process(account, event.chat_id, [event.message])
+
+    async def _on_album(self, account, event):
+        await self._process(account, event.chat_id, list(event.messages))
+
+    async def _process(self, account, chat_id: int, messages: list):
+        channel_name = self._names.get(chat_id)
+        if channel_name is None or (self.owns and not self.owns(channel_name)):
+            return
+        try:
+            added = await self.scraper.process_messages(
+                channel_name, messages, advance_cursor=False, account=account
+            )
+        except Exception as e:
+            print(f"❌ Ошибка обработки нового сообщения с канала @{channel_name}: {e}")
+            return
+        if added:
+            print(f"📨 Новый пост с канала @{channel_name}")
+            if self.on_new_posts:
+                self.on_new_posts()
@@ -0,0 +1,148 @@
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import asyncio
+import importlib.util
+import os
+import shutil
+import subprocess
+
+from .metrics import REGISTRY
+
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.mkv', '.webm'}
+
+BYTES_SAVED = REGISTRY.counter("media_recompress_saved_bytes_total", "Байт сэкономлено пережатием медиа")
+
+
+def optimized_path(path: Path) -> Path:
+    """Пережатая копия лежит рядом с оригиналом: photo_1.jpg -> photo_1.opt.jpg"""
+    suffix = '.jpg' if path.suffix.lower() in IMAGE_EXTENSIONS else '.mp4'
+    return path.with_name(f"{path.stem}.opt{suffix}")
+
+
+def keep_marker(path: Path) -> Path:
+    """Пустой файл-метка: пережатие не помогло, отправляем оригинал"""
+    return path.with_name(f"{path.name}.keep")
+
+
+def _write_atomic(dst: Path, encode) -> int:
+    tmp = dst.with_name(dst.name + '.part')
+    try:
+        encode(tmp)
+        os.replace(tmp, dst)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return dst.stat().st_size
+
+
+def _compress_image(src: str, dst: str, max_side: int, quality: int) -> int:
+    # Выполняется в дочернем процессе
+    from PIL import Image, ImageOps
+
+    def encode(tmp: Path):
+        with Image.open(src) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((max_side, max_side))
+            if img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            # EXIF не переносим: метаданные источника нам не нужны
+            img.save(tmp, 'JPEG', quality=quality, optimize=True, progressive=True)
+
+    return _write_atomic(Path(dst), encode)
+
+
+def _compress_video(src: str, dst: str, mode: str, max_height: int) -> int:
+    # Выполняется в дочернем процессе
+    def encode(tmp: Path):
+        command = ['ffmpeg', '-y', '-loglevel', 'error', '-i', src, '-map_metadata', '-1']
+        if mode == 'downscale':
+            command += [
+                '-vf', f"scale=-2:'min({max_height},ih)'",
+                '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '28', '-c:a', 'copy'
+            ]
+        else:
+            command += ['-c', 'copy']
+        command += ['-movflags', '+faststart', '-f', 'mp4', str(tmp)]
+        subprocess.run(command, check=True, capture_output=True, timeout=1800)
+
+    return _write_atomic(Path(dst), encode)
+
+
+class MediaCompressor:
+    """Пережимает фото и видео перед загрузкой в Telegram.
+
+    Кодирование идёт в пуле процессов, event loop не блокируется. Результат
+    кэшируется рядом с оригиналом, повторная попытка публикации его не
+    пересчитывает. video_mode: 'off', 'strip' (только убрать метаданные)
+    или 'downscale' (перекодировать до max_video_height).
+    """
+
+    def __init__(self, workers: int = 2, max_side: int = 2560, quality: int = 85,
+                 video_mode: str = 'off', max_video_height: int = 720):
+        self.max_side = max_side
+        self.quality = quality
+        self.max_video_height = max_video_height
+        self.images_enabled = importlib.util.find_spec('PIL') is not None
+        if not self.images_enabled:
+            print("⚠️ Pillow не установлен, фото отправляются без пережатия")
+        self.video_mode = video_mode
+        if video_mode != 'off' and shutil.which('ffmpeg') is None:
+            print("⚠️ ffmpeg не найден, видео отправляются без обработки")
+            self.video_mode = 'off'
+        self._executor = ProcessPoolExecutor(max_workers=max(1, workers))
+        self.bytes_saved = 0
+
+    async def prepare(self, paths: list[str]) -> list[str]:
+        """Возвращает пути для отправки: пережатые копии или оригиналы"""
+        prepared = []
+        saved = 0
+        for path in paths:
+            result, path_saved = await self._prepare_one(Path(path))
+            prepared.append(str(result))
+            saved += path_saved
+        if saved > 0:
+            self.bytes_saved += saved
+            BYTES_SAVED.inc(saved)
+            print(f"[COMPRESS] Сэкономлено {saved / 1024:.0f} КБ, всего {self.bytes_saved / 1024 / 1024:.1f} МБ")
+        return prepared
+
+    async def _prepare_one(self, path: Path) -> tuple[Path, int]:
+        extension = path.suffix.lower()
+        if extension in IMAGE_EXTENSIONS and self.images_enabled:
+            job = (_compress_image, self.max_side, self.quality)
+        elif extension in VIDEO_EXTENSIONS and self.video_mode != 'off':
+            job = (_compress_video, self.video_mode, self.max_video_height)
+        else:
+            return path, 0
+
+        target = optimized_path(path)
+        # Кэш: уже пережато или уже выяснили, что пережимать бесполезно
+        if target.exists():
+            return target, 0
+        if keep_marker(path).exists() or not path.exists():
+            return path, 0
+
+        func, *args = job
+        loop = asyncio.get_running_loop()
+        try:
+            size = await loop.run_in_executor(self._executor, func, str(path), str(target), *args)
+        except Exception as e:
+            print(f"[WARNING] Не удалось пережать {path.name}: {e}")
+            await asyncio.to_thread(self._keep_original, path, target)
+            return path, 0
+
+        original = path.stat().st_size
+        if size >= original:
+            await asyncio.to_thread(self._keep_original, path, target)
+            return path, 0
+        return target, original - size
+
+    @staticmethod
+    def _keep_original(path: Path, target: Path):
+        target.unlink(missing_ok=True)
+        keep_marker(path).touch()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
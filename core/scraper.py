@@ -1,183 +1,362 @@
 from pathlib import Path
+from typing import Optional
+import asyncio
+import time
+
+from telethon import errors
+
+from .albums import AlbumAssembler, MessageRecord
+from .client import Account, AccountPaused, ClientPool, BAN_ERRORS
+from .downloader import DownloadJob, MediaDownloader
+from .formatting import join_texts, pack_entities
+from .vector_db import VectorDB
+from .peers import PeerCache, PEER_ERRORS
+from .pipeline import PublishQueue
+from .metrics import tg_call, log_event, POSTS_SCRAPED
 
 
 class TGScraper:
-    def __init__(self, client, post_limit: int, db, download_root: str = "media"):
-        self.client = client
+    def __init__(self, client, post_limit: int, db, download_root: str = "media",
+                 request_interval: float = 0.5, backfill: bool = False,
+                 downloader: MediaDownloader = None, vector_db: VectorDB = None,
+                 pool: ClientPool = None, queue: PublishQueue = None):
+        # Очередь публикации: backpressure перед каждой страницей и пробуждение публикатора
+        self.queue = queue
+        # Без пула работаем одним аккаунтом client
+        self.pool = pool or ClientPool.single(client, request_interval, PeerCache(client, db))
+        self.vector_db = vector_db
+        self.downloader = downloader or MediaDownloader(client, pool=self.pool)
         self.post_limit = post_limit
         self.db = db
         self.download_root = download_root
+        # Дозаполнять ли пропуски между курсором и новыми сообщениями
+        self.backfill = backfill
+
+    async def scrape_channels(self, channels: list[str], concurrency: int = 4) -> dict:
+        """Парсит каналы параллельно, не более concurrency одновременно на аккаунт"""
+        semaphore = asyncio.Semaphore(max(1, concurrency) * self.pool.size)
+        cycle_started = time.monotonic()
+
+        async def run(channel_name: str):
+            async with semaphore:
+                return await self.scrape_channel(channel_name)
+
+        results = await asyncio.gather(*(run(channel) for channel in channels))
+        return self.summarize(results, time.monotonic() - cycle_started)
+
+    async def scrape_channel(self, channel_name: str) -> tuple[str, int, float, Optional[Exception]]:
+        """Парсит один канал; при FloodWait или бане повторяет через другой аккаунт"""
+        started = time.monotonic()
+        # Каждая повторная попытка достаётся следующему свободному аккаунту
+        for attempt in range(self.pool.size + 1):
+            account = self.pool.account_for(channel_name)
+            try:
+                added = await self.scrape_posts_from_one_channel(channel_name, account)
+                return channel_name, added, time.monotonic() - started, None
+            except errors.FloodWaitError as e:
+                # Флуд-лимит общий для аккаунта: тормозим все его каналы
+                self.pool.report_flood(account, e.seconds)
+                error = e
+            except AccountPaused as e:
+                error = e
+            except BAN_ERRORS as e:
+                self.pool.report_ban(account, e)
+                error = e
+            except Exception as e:
+                error = e
+                break
+        print(f"❌ Ошибка парсинга канала @{channel_name}: {error}")
+        return channel_name, 0, time.monotonic() - started, error
+
+    def summarize(self, results: list[tuple], elapsed: float) -> dict:
+        """Сводка цикла по результатам scrape_channel"""
+        summary = {
+            'elapsed': elapsed,
+            'added': sum(added for _, added, _, _ in results),
+            'channels': {
+                name: {'added': added, 'elapsed': channel_elapsed, 'error': error}
+                for name, added, channel_elapsed, error in results
+            },
+            'failed': [name for name, _, _, error in results if error is not None],
+        }
+        self._print_summary(summary)
+        log_event(
+            'scrape_cycle',
+            elapsed=round(summary['elapsed'], 3),
+            added=summary['added'],
+            failed=summary['failed'],
+            channels={name: round(stats['elapsed'], 3) for name, stats in summary['channels'].items()}
+        )
+        return summary
+
+    def _print_summary(self, summary: dict):
+        channels = summary['channels']
+        print(
+            f"📊 Цикл парсинга: {len(channels)} каналов за {summary['elapsed']:.1f} с., "
+            f"новых постов: {summary['added']}, ошибок: {len(summary['failed'])}"
+        )
+        slowest = sorted(channels.items(), key=lambda item: item[1]['elapsed'], reverse=True)
+        for name, stats in slowest[:5]:
+            print(f"   @{name}: {stats['elapsed']:.1f} с., новых постов: {stats['added']}")
+        if summary['failed']:
+            print(f"   Ошибки на каналах: {', '.join('@' + name for name in summary['failed'])}")
+
+    async def scrape_posts_from_one_channel(self, channel_name: str, account: Account = None):
+        account = account or self.pool.account_for(channel_name)
+        channel = await account.peers.resolve(channel_name, throttle=account.throttle)
+        cursor = await self.db.get_channel_cursor(channel_name)
 
-    async def scrape_posts_from_one_channel(self, channel_name: str):
-        channel = await self.client.get_entity(channel_name)
-        all_messages = []
+        try:
+            if cursor is None:
+                received, added = await self._scrape_latest(channel_name, account, channel)
+            else:
+                received, added = await self._scrape_since(channel_name, account, channel, cursor)
+                if self.backfill:
+                    gap_received, gap_added = await self._fill_gap(channel_name, account, channel)
+                    received += gap_received
+                    added += gap_added
+        except PEER_ERRORS:
+            # Канал удалён или сменил username: в следующем цикле резолвим заново
+            await account.peers.invalidate(channel_name)
+            raise
+
+        print(f'Получили {received} сообщений с канала @{channel_name}')
+        print(f'Занесли в БД {added} новых постов с канала @{channel_name}')
+        POSTS_SCRAPED.inc(added, channel=channel_name)
+        return added
+
+    async def _get_page(self, account: Account, channel, **kwargs) -> list:
+        if self.queue is not None:
+            await self.queue.wait_for_room()
+        self.pool.ensure_available(account)
+        await account.throttle()
+        with tg_call('get_messages'):
+            return await account.client.get_messages(channel, **kwargs)
+
+    async def _scrape_latest(self, channel_name: str, account: Account, channel) -> tuple[int, int]:
+        """Первый проход по каналу: последние post_limit постов.
+
+        Страницы сохраняются по мере получения, в памяти не больше одной
+        страницы и придержанного на её границе альбома.
+        """
+        assembler = AlbumAssembler()
+        received = added = posts_seen = 0
         offset_id = 0
-        posts_processed = 0
-
-        while posts_processed < self.post_limit:
-            batch_size = max(20, (self.post_limit - posts_processed) * 7)
-            messages = await self.client.get_messages(
-                channel,
-                limit=batch_size,
-                offset_id=offset_id
-            )
+        high_water = None
 
+        while posts_seen < self.post_limit:
+            batch_size = max(20, (self.post_limit - posts_seen) * 7)
+            messages = await self._get_page(account, channel, limit=batch_size, offset_id=offset_id)
             if not messages:
                 break
 
-            messages.sort(key=lambda msg: msg.id, reverse=True)
-
-            for msg in messages:
-                if not (msg.text or msg.media):
-                    continue
-
-                if not hasattr(msg, 'grouped_id') or not msg.grouped_id:
-                    posts_processed += 1
+            received += len(messages)
+            if high_water is None:
+                high_water = max(msg.id for msg in messages)
+            offset_id = min(msg.id for msg in messages)
 
-                all_messages.append(msg)
+            posts = assembler.feed(messages)[:self.post_limit - posts_seen]
+            posts_seen += len(posts)
+            added += await self._store_posts(channel_name, posts, account=account)
 
-                if posts_processed >= self.post_limit:
-                    break
+            if len(messages) < batch_size:
+                break
 
+        # Альбом за границей POST_LIMIT не берём, иначе он ещё может быть неполным
+        tail = assembler.finish() if posts_seen < self.post_limit else []
+        added += await self._store_posts(channel_name, tail, cursor=high_water, account=account)
+        return received, added
+
+    async def _scrape_since(self, channel_name: str, account: Account, channel,
+                            min_id: int, offset_id: int = 0,
+                            advance_cursor: bool = True) -> tuple[int, int]:
+        """Запрашивает только сообщения новее сохранённого курсора.
+
+        С offset_id - только сообщения между min_id и offset_id (дозаполнение пропуска).
+        """
+        batch_size = max(20, self.post_limit * 7)
+        assembler = AlbumAssembler()
+        received = added = 0
+        high_water = None
+
+        while True:
+            messages = await self._get_page(
+                account, channel, limit=batch_size, min_id=min_id, offset_id=offset_id
+            )
+            received += len(messages)
             if messages:
-                offset_id = messages[-1].id - 1
-
-        print(f'Получили {len(all_messages)} сообщений для {self.post_limit} постов с канала @{channel_name}')
+                high_water = max(high_water or 0, max(msg.id for msg in messages))
+            added += await self._store_posts(channel_name, assembler.feed(messages), account=account)
 
-        added = await self.process_messages(channel_name, all_messages)
-        print(f'Занесли в БД {added} новых постов с канала @{channel_name}')
-        return added
-
-    async def process_messages(self, channel_name: str, messages: list):
-        messages.sort(key=lambda msg: msg.id)
-
-        grouped_messages = {}
-        single_messages = []
-        processed_groups = set()
-
-        for msg in messages:
-            if not (msg.text or msg.media):
-                continue
-
-            if msg.grouped_id:
-                if msg.grouped_id in processed_groups:
-                    continue
+            if len(messages) < batch_size:
+                break
+            offset_id = min(msg.id for msg in messages)
+            if not self.backfill:
+                # Курсор всё равно уйдёт вперёд, поэтому пропуск запоминаем
+                await self.db.record_channel_gap(channel_name, min_id, offset_id)
+                print(f"⚠️ Сообщения @{channel_name} между {min_id} и {offset_id} пропущены, "
+                      f"включите SCRAPE_BACKFILL, чтобы их дозаполнить")
+                break
 
-                if msg.grouped_id not in grouped_messages:
-                    grouped_messages[msg.grouped_id] = []
-                grouped_messages[msg.grouped_id].append(msg)
-            else:
-                single_messages.append(msg)
+        # Курсор двигаем только после всех страниц: при сбое пропуск дозаполнится
+        added += await self._store_posts(
+            channel_name, assembler.finish(),
+            cursor=high_water if advance_cursor else None, account=account
+        )
+        return received, added
+
+    async def _fill_gap(self, channel_name: str, account: Account, channel) -> tuple[int, int]:
+        """Дозаполняет пропуск, оставленный, пока SCRAPE_BACKFILL был выключен"""
+        gap = await self.db.get_channel_gap(channel_name)
+        if gap is None:
+            return 0, 0
+        gap_from, gap_to = gap
+        print(f"🔁 Дозаполняем пропуск @{channel_name} между {gap_from} и {gap_to}")
+        received, added = await self._scrape_since(
+            channel_name, account, channel, gap_from, offset_id=gap_to, advance_cursor=False
+        )
+        await self.db.clear_channel_gap(channel_name)
+        return received, added
+
+    async def process_messages(self, channel_name: str, messages: list, advance_cursor: bool = True,
+                               account: Account = None):
+        """Сохраняет посты из готового набора сообщений (например, из real-time обновлений).
+
+        account - аккаунт, получивший сообщения: медиа скачиваются через него.
+        """
+        assembler = AlbumAssembler()
+        posts = assembler.feed(messages) + assembler.finish()
+        high_water = max((msg.id for msg in messages), default=None) if advance_cursor else None
+        return await self._store_posts(channel_name, posts, cursor=high_water, account=account)
+
+    async def _store_posts(self, channel_name: str, groups: list[list[MessageRecord]],
+                           cursor: Optional[int] = None, account: Account = None) -> int:
+        """Скачивает медиа новых постов и сохраняет их вместе с курсором канала"""
+        if not groups:
+            if cursor is not None:
+                await self.db.add_posts_bulk([], cursor=(channel_name, cursor))
+            return 0
+        groups.sort(key=lambda group: group[0].id)
+
+        # Одним запросом отсеиваем уже известные посты
+        existing = await self.db.get_existing_post_keys(
+            [(channel_name, group[0].id) for group in groups]
+        )
+        new_groups = [group for group in groups if (channel_name, group[0].id) not in existing]
+        if len(new_groups) < len(groups):
+            print(f"Пропускаем {len(groups) - len(new_groups)} постов, уже существующих в базе")
+
+        # Медиа скачиваем только для действительно новых постов
+        posts = []
+        jobs = []
+        for group in new_groups:
+            post_data, post_jobs = self._build_post(channel_name, group, account)
+            posts.append(post_data)
+            jobs.append((post_data, post_jobs))
+
+        # Смысловые дубликаты сохраняем без медиа, публиковаться они не будут
+        reservation = None
+        if self.vector_db is not None:
+            reservation = await self.vector_db.mark_duplicates(posts)
+            jobs = [(post_data, post_jobs) for post_data, post_jobs in jobs
+                    if not post_data.get('is_duplicate')]
 
         added = 0
-
-        for group_id, group in grouped_messages.items():
-            processed_groups.add(group_id)
-
-            group.sort(key=lambda msg: msg.date)
-
-            group_id_val = group[0].id
-            print(f"Обрабатываем альбом {group_id_val} с {len(group)} медиа")
-            added += await self._process_group(channel_name, group)
-
-        for msg in single_messages:
-            if any(msg in group for group in grouped_messages.values()):
-                continue
-            print(f"Обрабатываем одиночное сообщение {msg.id}")
-            added += await self._process_single_message(channel_name, msg)
-
+        try:
+            download_jobs = [job for _, post_jobs in jobs for job in post_jobs]
+            await self._download(download_jobs)
+            for post_data, post_jobs in jobs:
+                for job in post_jobs:
+                    post_data['media'].extend(job.result)
+
+            added = await self.db.add_posts_bulk(
+                posts, cursor=(channel_name, cursor) if cursor is not None else None
+            )
+        finally:
+            if self.vector_db is not None:
+                # В индекс - только после записи в БД, см. VectorDB.mark_duplicates
+                if added:
+                    await self.vector_db.add(reservation)
+                else:
+                    self.vector_db.discard(reservation)
+        if added:
+            await self._ensure_blob_files(channel_name, posts)
+        if added and self.queue is not None:
+            self.queue.notify()
         return added
 
-    async def _process_group(self, channel_name: str, group: list):
-        group_id = group[0].id
-
-        if await self.db.post_exists(group_id, channel_name):
-            print(f"Пост {group_id} уже существует в базе, пропускаем")
-            return 0
-
-        has_media = any(msg.media for msg in group)
-        post_dir = None
-
-        if has_media:
-            post_dir = Path(self.download_root) / channel_name / str(group_id)
-            post_dir.mkdir(parents=True, exist_ok=True)
-
-        post_data = {
-            'id': group_id,
-            'channel': channel_name,
-            'date': group[0].date,
-            'text': "",
-            'media': []
+    async def _ensure_blob_files(self, channel_name: str, posts: list[dict]):
+        """Проверяет файлы хранилища, на которые посты сослались при записи.
+
+        Пока пост скачивался, публикатор или очистка могли освободить
+        последнюю ссылку на тот же файл и удалить его. Теперь ссылка наша,
+        и пропавший файл скачивается заново по прежнему пути.
+        """
+        wanted = {
+            m['blob']['path']: m['ref']['message_id']
+            for post in posts
+            for m in post['media']
+            if m.get('blob') and m.get('ref')
         }
-
-        texts = []
-        for msg in group:
-            if msg.text and msg.text.strip():
-                texts.append(msg.text.strip())
-
-        post_data['text'] = "\n\n".join(texts) if texts else ""
-
-        for i, msg in enumerate(group):
-            if msg.media and has_media:
-                print(f"Скачиваем медиа {i + 1}/{len(group)} для альбома {group_id}")
-                await self._download_media(msg, post_dir, post_data['media'])
-
-        return 1 if await self.db.add_post(post_data) else 0
-
-    async def _process_single_message(self, channel_name: str, msg):
-        if await self.db.post_exists(msg.id, channel_name):
-            print(f"Пост {msg.id} уже существует в базе, пропускаем")
-            return 0
-
-        has_media = bool(msg.media)
-        post_dir = None
-
-        if has_media:
-            post_dir = Path(self.download_root) / channel_name / str(msg.id)
-            post_dir.mkdir(parents=True, exist_ok=True)
+        if not wanted:
+            return
+        missing = await asyncio.to_thread(
+            lambda: {message_id: path for path, message_id in wanted.items() if not Path(path).exists()}
+        )
+        if missing:
+            print(f"⚠️ {len(missing)} файлов хранилища удалены во время сохранения постов, скачиваем заново")
+            await self.downloader.restore(channel_name, missing)
+
+    async def _download(self, jobs: list[DownloadJob]):
+        store = self.downloader.store
+        if store is None or self.downloader.reference_only:
+            await self.downloader.download_many(jobs)
+            return
+
+        # Файлы, которые уже есть в хранилище, повторно не скачиваются
+        keys = [key for key in (store.file_key(job.message) for job in jobs) if key]
+        known = await self.db.get_blobs(keys)
+        await self.downloader.download_many(jobs, known_blobs=known)
+
+        # Перезалитые под другим id файлы дедуплицируем по содержимому
+        fresh = [
+            m['blob'] for job in jobs for m in job.result
+            if m.get('blob') and m['blob']['key'] not in known
+        ]
+        same_content = await self.db.get_blob_paths_by_hash([blob['hash'] for blob in fresh])
+        duplicates = []
+        for blob in fresh:
+            existing_path = same_content.get(blob['hash'])
+            if existing_path and existing_path != blob['path'] and Path(existing_path).exists():
+                duplicates.append(blob['path'])
+                blob['path'] = existing_path
+        if duplicates:
+            await store.remove_files(duplicates)
+            for job in jobs:
+                for m in job.result:
+                    if m.get('blob'):
+                        m['file_path'] = m['blob']['path']
+
+    def _build_post(self, channel_name: str, group: list[MessageRecord],
+                    account: Account = None) -> tuple[dict, list[DownloadJob]]:
+        post_id = group[0].id
+        if len(group) > 1:
+            print(f"Обрабатываем альбом {post_id} с {len(group)} медиа")
+            text, entities = join_texts([(msg.text, msg.entities) for msg in group])
+        else:
+            print(f"Обрабатываем одиночное сообщение {post_id}")
+            text, entities = group[0].text or "", group[0].entities
 
         post_data = {
-            'id': msg.id,
+            'id': post_id,
             'channel': channel_name,
-            'date': msg.date,
-            'text': msg.text,
+            'date': group[0].date,
+            'text': text,
+            'entities': pack_entities(entities),
             'media': []
         }
 
-        if has_media:
-            await self._download_media(msg, post_dir, post_data['media'])
-
-        return 1 if await self.db.add_post(post_data) else 0
-
-    async def _download_media(self, message, directory: Path, media_list: list):
-        try:
-            potential_path = directory / f"{message.id}_media"
-            if potential_path.exists():
-                print(f"Медиа уже существует: {potential_path}")
-                return
-
-            downloaded = await self.client.download_media(
-                message,
-                file=directory,
-                thumb=-1 if hasattr(message.media, 'photo') else None
-            )
-
-            paths = downloaded if isinstance(downloaded, list) else [downloaded]
-
-            for path in paths:
-                if message.photo:
-                    mtype = "photo"
-                elif message.document:
-                    if message.document.mime_type.startswith('video'):
-                        mtype = "video"
-                    else:
-                        mtype = (message.document.mime_type or "document").split("/")[-1]
-                else:
-                    mtype = "unknown"
-
-                media_list.append({
-                    'type': mtype,
-                    'file_path': str(path),
-                })
-        except Exception as e:
-            print(f"Ошибка при скачивании медиа: {e}")
\ No newline at end of file
+        post_dir = Path(self.download_root) / channel_name / str(post_id)
+        jobs = [DownloadJob(msg, post_dir, channel=channel_name, account=account)
+                for msg in group if msg.media]
+        return post_data, jobs
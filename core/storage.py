@@ -0,0 +1,74 @@
+from pathlib import Path
+from typing import Optional
+import asyncio
+import hashlib
+
+from telethon import utils
+
+from .recompress import optimized_path, keep_marker
+
+
+class MediaStore:
+    """Хранилище медиа, адресуемое по id файла в Telegram.
+
+    Одинаковые фото и видео из разных постов лежат в одном файле
+    media/blobs/<xx>/<ключ><расширение>, а строки Media ссылаются на него
+    через MediaBlob со счётчиком ссылок.
+    """
+
+    def __init__(self, root: str = "media"):
+        self.root = Path(root) / "blobs"
+
+    @staticmethod
+    def file_key(message) -> Optional[str]:
+        if message.photo:
+            return f"photo_{message.photo.id}"
+        if message.document:
+            return f"doc_{message.document.id}"
+        return None
+
+    def path_for(self, key: str, message) -> Path:
+        extension = utils.get_extension(message.media)
+        return self.root / key[-2:] / f"{key}{extension}"
+
+    @staticmethod
+    def _hash_file(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    async def content_hash(self, path: Path) -> str:
+        return await asyncio.to_thread(self._hash_file, path)
+
+    @staticmethod
+    def _remove(paths: list[str]) -> int:
+        removed = 0
+        for file_path in paths:
+            try:
+                path = Path(file_path)
+                if path.exists():
+                    removed += path.stat().st_size
+                    path.unlink()
+                    print(f"Удален медиафайл: {path}")
+                # Вместе с оригиналом уходит и его пережатая копия
+                for variant in (optimized_path(path), keep_marker(path)):
+                    if variant.exists():
+                        removed += variant.stat().st_size
+                        variant.unlink()
+
+                # Удаляем пустые директории
+                media_dir = path.parent
+                if media_dir.exists() and not any(media_dir.iterdir()):
+                    media_dir.rmdir()
+            except Exception as e:
+                print(f"Ошибка удаления файла {file_path}: {e}")
+        return removed
+
+    @staticmethod
+    async def remove_files(paths: list[str]) -> int:
+        """Удаляет файлы вне event loop, возвращает число освобождённых байт"""
+        if not paths:
+            return 0
+        return await asyncio.to_thread(MediaStore._remove, paths)
@@ -0,0 +1,253 @@
+from pathlib import Path
+from typing import Optional
+import asyncio
+import os
+import time
+
+
+class VectorDB:
+    """Поиск смысловых дубликатов постов по эмбеддингам текста.
+
+    Индекс FAISS хранится на диске в двух частях: основная (base) открывается
+    через mmap и только читается, новые векторы пишутся в небольшую дельту.
+    При уплотнении дельта сливается с основной частью, а векторы старше
+    retention_days выбрасываются.
+    """
+
+    def __init__(self, path: str = "vector_db",
+                 model_name: str = "paraphrase-multilingual-MiniLM-L12-v2",
+                 threshold: float = 0.92, retention_days: int = 3,
+                 batch_size: int = 32, min_text_length: int = 30,
+                 compact_every: int = 1000):
+        self.path = Path(path)
+        self.model_name = model_name
+        self.threshold = threshold
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.min_text_length = min_text_length
+        self.compact_every = compact_every
+
+        self._model = None
+        self._dim = None
+        self._base = None
+        self._delta = None
+        # id вектора -> timestamp поста, нужен для вытеснения старых записей
+        self._timestamps: dict[int, float] = {}
+        self._next_id = 1
+        # Зарезервированные, но ещё не записанные в индекс векторы:
+        # номер резерва -> (векторы, timestamps)
+        self._pending: dict[int, tuple] = {}
+        self._next_reservation = 1
+        self._lock = asyncio.Lock()
+
+    @property
+    def _base_file(self) -> Path:
+        return self.path / "base.index"
+
+    @property
+    def _delta_file(self) -> Path:
+        return self.path / "delta.index"
+
+    @property
+    def _meta_file(self) -> Path:
+        return self.path / "meta.npz"
+
+    async def load(self):
+        await asyncio.to_thread(self._load)
+        print(f"✅ Векторный индекс загружен: {len(self._timestamps)} записей")
+
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+        import numpy as np
+
+        self._model = SentenceTransformer(self.model_name, device='cpu')
+        self._dim = self._model.get_sentence_embedding_dimension()
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        self._base = self._read_index(self._base_file, mmap=True)
+        self._delta = self._read_index(self._delta_file, mmap=False)
+
+        if self._meta_file.exists():
+            meta = np.load(self._meta_file)
+            self._timestamps = dict(zip(meta['ids'].tolist(), meta['timestamps'].tolist()))
+            self._next_id = int(meta['next_id'])
+
+    def _empty_index(self):
+        import faiss
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(self._dim))
+
+    def _read_index(self, path: Path, mmap: bool):
+        import faiss
+
+        if not path.exists():
+            return self._empty_index()
+        if mmap:
+            try:
+                return faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError:
+                pass
+        return faiss.read_index(str(path))
+
+    def _write_index(self, index, path: Path):
+        import faiss
+
+        tmp_path = path.with_suffix('.tmp')
+        faiss.write_index(index, str(tmp_path))
+        os.replace(tmp_path, path)
+
+    def _save_meta(self):
+        import numpy as np
+
+        tmp_path = self.path / "meta.tmp.npz"
+        np.savez(
+            tmp_path,
+            ids=np.fromiter(self._timestamps.keys(), dtype=np.int64, count=len(self._timestamps)),
+            timestamps=np.fromiter(self._timestamps.values(), dtype=np.float64, count=len(self._timestamps)),
+            next_id=np.int64(self._next_id)
+        )
+        os.replace(tmp_path, self._meta_file)
+
+    def _embed(self, texts: list[str]):
+        return self._model.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        ).astype('float32')
+
+    async def mark_duplicates(self, posts: list[dict]) -> Optional[int]:
+        """Помечает post['is_duplicate'] у постов, похожих на уже виденные.
+
+        Векторы уникальных постов резервируются под тем же локом, что и
+        проверка: параллельный парсинг другого канала уже сравнивает с ними.
+        В индекс они попадают через add после сохранения постов в БД, а при
+        сбое записи резерв снимается через discard. Возвращает номер резерва.
+        """
+        if self._model is None:
+            return None
+        candidates = [
+            p for p in posts
+            if p['text'] and len(p['text'].strip()) >= self.min_text_length
+        ]
+        if not candidates:
+            return None
+
+        vectors = await asyncio.to_thread(self._embed, [p['text'] for p in candidates])
+        async with self._lock:
+            flags = await asyncio.to_thread(self._check, vectors)
+
+            unique = []
+            for position, (post, (is_duplicate, score)) in enumerate(zip(candidates, flags)):
+                if is_duplicate:
+                    post['is_duplicate'] = True
+                    print(f"Пост {post['id']} с канала @{post['channel']} - дубликат (сходство {score:.2f})")
+                else:
+                    unique.append(position)
+            if not unique:
+                return None
+            reservation = self._next_reservation
+            self._next_reservation += 1
+            self._pending[reservation] = (
+                vectors[unique], [candidates[i]['date'].timestamp() for i in unique]
+            )
+            return reservation
+
+    async def add(self, reservation: Optional[int]):
+        """Записывает в индекс векторы резерва, выданного mark_duplicates"""
+        if reservation is None:
+            return
+        async with self._lock:
+            pending = self._pending.pop(reservation, None)
+            if pending is not None:
+                await asyncio.to_thread(self._add, *pending)
+
+    def discard(self, reservation: Optional[int]):
+        """Снимает резерв: посты не сохранились и дубликатами других не считаются"""
+        if reservation is not None:
+            self._pending.pop(reservation, None)
+
+    def _check(self, vectors) -> list[tuple[bool, float]]:
+        import numpy as np
+
+        best = np.full(len(vectors), -1.0, dtype='float32')
+        for index in (self._base, self._delta):
+            if index.ntotal:
+                scores, _ = index.search(vectors, 1)
+                best = np.maximum(best, scores[:, 0])
+        # Посты, которые другие каналы как раз сохраняют
+        for reserved, _ in self._pending.values():
+            best = np.maximum(best, (vectors @ reserved.T).max(axis=1))
+
+        duplicate = best >= self.threshold
+        # Дубликаты внутри самой пачки: сравниваем с более ранними постами
+        similarity = vectors @ vectors.T
+        for i in range(len(vectors)):
+            if duplicate[i]:
+                continue
+            for j in range(i):
+                if not duplicate[j] and similarity[i, j] >= self.threshold:
+                    duplicate[i] = True
+                    best[i] = similarity[i, j]
+                    break
+
+        return list(zip(duplicate.tolist(), best.tolist()))
+
+    def _add(self, vectors, timestamps: list[float]):
+        import numpy as np
+
+        ids = np.arange(self._next_id, self._next_id + len(vectors), dtype=np.int64)
+        self._next_id += len(vectors)
+        self._delta.add_with_ids(vectors, ids)
+        self._timestamps.update(zip(ids.tolist(), timestamps))
+
+        if self._delta.ntotal >= self.compact_every:
+            self._compact()
+        else:
+            self._write_index(self._delta, self._delta_file)
+            self._save_meta()
+
+    async def evict_expired(self) -> int:
+        """Убирает из индекса записи старше retention_days.
+
+        Уплотнение переписывает весь индекс, поэтому запускаем его, только
+        когда самая старая запись действительно устарела.
+        """
+        if self._model is None:
+            return 0
+        cutoff = time.time() - self.retention_days * 24 * 3600
+        if not self._timestamps or min(self._timestamps.values()) >= cutoff:
+            return 0
+        async with self._lock:
+            evicted = await asyncio.to_thread(self._compact)
+        if evicted:
+            print(f"🗑️ Из векторного индекса удалено {evicted} устаревших записей")
+        return evicted
+
+    def _compact(self) -> int:
+        """Сливает дельту с основной частью индекса и вытесняет старые векторы"""
+        import faiss
+        import numpy as np
+
+        cutoff = time.time() - self.retention_days * 24 * 3600
+        merged = self._empty_index()
+        evicted = 0
+
+        for index in (self._base, self._delta):
+            if not index.ntotal:
+                continue
+            ids = faiss.vector_to_array(index.id_map)
+            vectors = index.index.reconstruct_n(0, index.ntotal)
+            fresh = np.array([self._timestamps.get(i, 0) >= cutoff for i in ids.tolist()], dtype=bool)
+            evicted += int((~fresh).sum())
+            if fresh.any():
+                merged.add_with_ids(vectors[fresh], ids[fresh])
+
+        self._timestamps = {i: ts for i, ts in self._timestamps.items() if ts >= cutoff}
+
+        self._write_index(merged, self._base_file)
+        self._delta = self._empty_index()
+        self._write_index(self._delta, self._delta_file)
+        self._save_meta()
+        self._base = self._read_index(self._base_file, mmap=True)
+        return evicted
@@ -1,22 +1,145 @@
+"""Поиск и просмотр постов в базе, только на чтение.
+
+Примеры (из корня репозитория):
+
+    python -m core.view_posts
+    python -m core.view_posts "курс доллара" --channel rbc_news --since 2024-05-01
+    python -m core.view_posts --unpublished --limit 100 --format json
+    python -m core.view_posts выборы --all --format csv --output posts.csv
+
+Поиск идёт по полнотекстовому индексу posts.search_vector (GIN), страницы
+листаются по ключу (date, id): следующую страницу даёт --after из вывода.
+Схему не создаёт и ничего не удаляет, транзакция открывается READ ONLY.
+"""
+from datetime import datetime, timezone
+import argparse
 import asyncio
-from core.db_manager import DBManager
+import csv
+import json
+import sys
+
 from dotenv import load_dotenv
-from sqlalchemy import text
+from sqlalchemy import select, func, literal_column, tuple_
+
+from core.db_manager import DBManager
+from core.db_models import Post
 
 
 load_dotenv()
 
-async def show_posts():
+COLUMNS = ['id', 'channel_name', 'post_id', 'date', 'published', 'is_duplicate', 'text']
+
+
+def parse_date(value: str) -> datetime:
+    date = datetime.fromisoformat(value)
+    return date if date.tzinfo else date.replace(tzinfo=timezone.utc)
+
+
+def parse_cursor(value: str) -> tuple[datetime, int]:
+    date, post_id = value.rsplit(',', 1)
+    return datetime.fromisoformat(date), int(post_id)
+
+
+def build_query(db: DBManager, args, after: tuple[datetime, int] = None):
+    stmt = select(
+        Post.id, Post.channel_name, Post.post_id, Post.date,
+        Post.published, Post.is_duplicate, Post.text
+    )
+    if args.query:
+        if db.is_postgres:
+            stmt = stmt.where(literal_column("search_vector").op("@@")(
+                func.websearch_to_tsquery('russian', args.query)
+            ))
+        else:
+            stmt = stmt.where(Post.text.ilike(f"%{args.query}%"))
+    if args.channel:
+        stmt = stmt.where(Post.channel_name.in_(args.channel))
+    if args.since:
+        stmt = stmt.where(Post.date >= parse_date(args.since))
+    if args.until:
+        stmt = stmt.where(Post.date < parse_date(args.until))
+    if args.published:
+        stmt = stmt.where(Post.published == True)
+    if args.unpublished:
+        stmt = stmt.where(Post.published == False)
+    if after is not None:
+        stmt = stmt.where(tuple_(Post.date, Post.id) < tuple_(*after))
+    return stmt.order_by(Post.date.desc(), Post.id.desc()).limit(args.limit)
+
+
+async def fetch_pages(db: DBManager, args):
+    """Страницы результата; без --all только первая"""
+    after = parse_cursor(args.after) if args.after else None
+    async with db.engine.connect() as conn:
+        if db.is_postgres:
+            await conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+        while True:
+            rows = (await conn.execute(build_query(db, args, after))).mappings().all()
+            if not rows:
+                return
+            yield rows
+            if len(rows) < args.limit or not args.all:
+                return
+            after = (rows[-1]['date'], rows[-1]['id'])
+
+
+def print_table(rows, out):
+    for row in rows:
+        text = (row['text'] or '').replace('\n', ' ')
+        if len(text) > 80:
+            text = text[:77] + '...'
+        status = 'опубликован' if row['published'] else ('дубликат' if row['is_duplicate'] else 'в очереди')
+        print(f"{row['date']:%Y-%m-%d %H:%M} @{row['channel_name']}/{row['post_id']} [{status}] {text}", file=out)
+
+
+async def run(args) -> int:
     db = DBManager()
-    await db.initialize()
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    writer = None
+    total = 0
+    last = None
+    try:
+        async for rows in fetch_pages(db, args):
+            total += len(rows)
+            last = rows[-1]
+            if args.format == 'json':
+                for row in rows:
+                    out.write(json.dumps(dict(row), ensure_ascii=False, default=str) + '\n')
+            elif args.format == 'csv':
+                if writer is None:
+                    writer = csv.DictWriter(out, fieldnames=COLUMNS)
+                    writer.writeheader()
+                writer.writerows(dict(row) for row in rows)
+            else:
+                print_table(rows, out)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+        await db.close()
+
+    # Служебный вывод - в stderr, чтобы не портить JSON/CSV
+    print(f"Найдено: {total}", file=sys.stderr)
+    if last is not None and total % args.limit == 0 and not args.all:
+        print(f"Следующая страница: --after '{last['date'].isoformat()},{last['id']}'", file=sys.stderr)
+    return total
+
 
-    async with db.async_session() as session:
-        result = await session.execute(text("SELECT * FROM posts ORDER BY date DESC LIMIT 10;"))
-        posts = result.fetchall()
-        for post in posts:
-            print(post)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Поиск по постам в базе (только чтение)")
+    parser.add_argument('query', nargs='?', help="поисковый запрос, синтаксис websearch_to_tsquery")
+    parser.add_argument('--channel', action='append', help="канал-источник, можно несколько раз")
+    parser.add_argument('--since', help="дата от (ISO, включительно)")
+    parser.add_argument('--until', help="дата до (ISO, не включительно)")
+    status = parser.add_mutually_exclusive_group()
+    status.add_argument('--published', action='store_true', help="только опубликованные")
+    status.add_argument('--unpublished', action='store_true', help="только неопубликованные")
+    parser.add_argument('--limit', type=int, default=20, help="постов на страницу")
+    parser.add_argument('--after', help="курсор 'дата,id' последней строки предыдущей страницы")
+    parser.add_argument('--all', action='store_true', help="выгрузить все страницы")
+    parser.add_argument('--format', choices=['table', 'json', 'csv'], default='table')
+    parser.add_argument('--output', help="файл для выгрузки, по умолчанию stdout")
+    return parser.parse_args(argv)
 
-    await db.close()
 
 if __name__ == "__main__":
-    asyncio.run(show_posts())
\ No newline at end of file
+    asyncio.run(run(parse_args()))
@@ -2,12 +2,21 @@ import os
 from dotenv import load_dotenv
 import asyncio
 import sys
-import shutil
+import time
 
-from core.client import TelegramClientManager
+from core.client import ClientPool
 from core.scraper import TGScraper
+from core.downloader import MediaDownloader
+from core.storage import MediaStore
+from core.vector_db import VectorDB
 from core.db_manager import DBManager
 from core.publisher import PostPublisher
+from core.realtime import RealtimeListener
+from core.cleaner import MediaJanitor
+from core.jobs import JobQueue
+from core.pipeline import PublishQueue
+from core.recompress import MediaCompressor
+from core import metrics
 
 load_dotenv()
 
@@ -27,55 +36,271 @@ CONFIG = {
     'API_HASH': os.environ.get('API_HASH'),
     'PHONE': os.environ.get('PHONE'),
     'SESSION_FILE': os.environ.get('SESSION_FILE', 'tg_session'),
+    # Несколько аккаунтов: сессии и телефоны через запятую, в одном порядке
+    'SESSION_FILES': [x.strip() for x in os.getenv('SESSION_FILES', '').split(',') if x.strip()],
+    'PHONES': [x.strip() for x in os.getenv('PHONES', '').split(',') if x.strip()],
     'CHANNELS': [x.strip() for x in os.getenv('CHANNELS').split(',') if x.strip()],
     'MY_CHANNEL': os.environ.get('MY_CHANNEL'),
     'POST_LIMIT': int(os.environ.get('POST_LIMIT', 5)),
     'PARSE_INTERVAL': int(os.environ.get('PARSE_INTERVAL', 3600)),
-    'PUBLISH_DELAY': int(os.environ.get('PUBLISH_DELAY', 10)),
+    'PUBLISH_RATE': float(
+        os.environ.get('PUBLISH_RATE')
+        or 60 / max(1, int(os.environ.get('PUBLISH_DELAY', 10)))
+    ),
+    'PUBLISH_BURST': int(os.environ.get('PUBLISH_BURST', 3)),
+    'PUBLISH_RATE_LIMITS': {
+        target.strip(): (float(rate), int(burst))
+        for target, rate, burst in (
+            x.split(':') for x in os.getenv('PUBLISH_RATE_LIMITS', '').split(',') if x.strip()
+        )
+    },
+    'PUBLISH_MAX_ATTEMPTS': int(os.environ.get('PUBLISH_MAX_ATTEMPTS', 5)),
+    'PUBLISH_PAGE_SIZE': int(os.environ.get('PUBLISH_PAGE_SIZE', 100)),
+    # Текст длиннее лимита подписи/сообщения: truncate - обрезать, split - дослать отдельно
+    'CAPTION_OVERFLOW': os.environ.get('CAPTION_OVERFLOW', 'truncate'),
+    # Парсинг приостанавливается, пока в очереди публикации столько постов (0 - без лимита)
+    'PUBLISH_BACKLOG_LIMIT': int(os.environ.get('PUBLISH_BACKLOG_LIMIT', 500)),
+    'REALTIME': os.environ.get('REALTIME', '0') == '1',
+    'GAP_FILL_INTERVAL': int(os.environ.get('GAP_FILL_INTERVAL', 900)),
+    # Сколько каналов слушает в real-time один воркер (0 - сколько достанется)
+    'REALTIME_CHANNELS_PER_WORKER': int(os.environ.get('REALTIME_CHANNELS_PER_WORKER', 0)),
+    'PEER_CACHE_TTL_HOURS': float(os.environ.get('PEER_CACHE_TTL_HOURS', 168)),
+    'WORKER_ID': os.environ.get('WORKER_ID'),
+    'JOB_LEASE_SECONDS': int(os.environ.get('JOB_LEASE_SECONDS', 300)),
+    'JOB_POLL_INTERVAL': int(os.environ.get('JOB_POLL_INTERVAL', 60)),
+    'SCRAPE_CONCURRENCY': int(os.environ.get('SCRAPE_CONCURRENCY', 4)),
+    'TG_REQUEST_INTERVAL': float(os.environ.get('TG_REQUEST_INTERVAL', 0.5)),
+    'SCRAPE_BACKFILL': os.environ.get('SCRAPE_BACKFILL', '0') == '1',
+    'DOWNLOAD_WORKERS': int(os.environ.get('DOWNLOAD_WORKERS', 4)),
+    'DOWNLOAD_CONCURRENCY': int(os.environ.get('DOWNLOAD_CONCURRENCY', 8)),
+    'MAX_MEDIA_SIZE_MB': int(os.environ.get('MAX_MEDIA_SIZE_MB', 0)),
+    'DEDUP_ENABLED': os.environ.get('DEDUP_ENABLED', '0') == '1',
+    'DEDUP_THRESHOLD': float(os.environ.get('DEDUP_THRESHOLD', 0.92)),
+    'DEDUP_MODEL': os.environ.get('DEDUP_MODEL', 'paraphrase-multilingual-MiniLM-L12-v2'),
+    'DEDUP_INDEX_PATH': os.environ.get('DEDUP_INDEX_PATH', 'vector_db'),
+    'RETENTION_DAYS': int(os.environ.get('RETENTION_DAYS', 3)),
+    'PUBLISHED_RETENTION_DAYS': int(os.environ.get('PUBLISHED_RETENTION_DAYS', 30)),
+    'POSTS_PARTITIONING': os.environ.get('POSTS_PARTITIONING', '0') == '1',
+    'JANITOR_INTERVAL': int(os.environ.get('JANITOR_INTERVAL', 600)),
+    'MEDIA_QUOTA_MB': int(os.environ.get('MEDIA_QUOTA_MB', 0)),
+    'METRICS_PORT': int(os.environ.get('METRICS_PORT', 0)),
+    'METRICS_HOST': os.environ.get('METRICS_HOST', '127.0.0.1'),
+    'LOG_FORMAT': os.environ.get('LOG_FORMAT', 'text'),
+    'MEDIA_MODE': os.environ.get('MEDIA_MODE', 'download'),
+    # Общая ли папка media/ у всех воркеров. Если у каждого своя, при старте
+    # не докачиваем чужие медиа: недостающее публикатор берёт из Telegram
+    'MEDIA_SHARED': os.environ.get('MEDIA_SHARED', '1') == '1',
+    'RECOMPRESS': os.environ.get('RECOMPRESS', '0') == '1',
+    'RECOMPRESS_WORKERS': int(os.environ.get('RECOMPRESS_WORKERS', 2)),
+    'RECOMPRESS_MAX_SIDE': int(os.environ.get('RECOMPRESS_MAX_SIDE', 2560)),
+    'RECOMPRESS_QUALITY': int(os.environ.get('RECOMPRESS_QUALITY', 85)),
+    'RECOMPRESS_VIDEO': os.environ.get('RECOMPRESS_VIDEO', 'off'),
+    'RECOMPRESS_VIDEO_HEIGHT': int(os.environ.get('RECOMPRESS_VIDEO_HEIGHT', 720)),
+    'MEDIA_TYPES': {x.strip() for x in os.getenv('MEDIA_TYPES', '').split(',') if x.strip()},
 }
 
 async def main():
+    if CONFIG['LOG_FORMAT'] == 'json':
+        metrics.setup_json_logging()
+
+    # Папку не очищаем: что уже скачано, сверяется с БД при старте (janitor.reconcile)
     media_folder = 'media'
-    if os.path.exists(media_folder):
-        shutil.rmtree(media_folder)
     os.makedirs(media_folder, exist_ok=True)
 
-    tg_client_manager = TelegramClientManager(
-        CONFIG['SESSION_FILE'],
-        CONFIG['API_ID'],
-        CONFIG['API_HASH'],
-        CONFIG['PHONE']
-    )
     try:
-        tg_client = await tg_client_manager.start()
+        pool = await ClientPool.start(
+            CONFIG['SESSION_FILES'] or [CONFIG['SESSION_FILE']],
+            CONFIG['API_ID'],
+            CONFIG['API_HASH'],
+            CONFIG['PHONES'] or [CONFIG['PHONE']],
+            request_interval=CONFIG['TG_REQUEST_INTERVAL']
+        )
     except Exception as e:
-        print(f"❌ Не удалось запустить TelegramClientManager: {e}")
+        print(f"❌ Не удалось запустить клиенты Telegram: {e}")
         return
+    # Публикует основной (первый) аккаунт, он должен быть админом MY_CHANNEL
+    tg_client = pool.primary.client
 
-    db = DBManager()
+    db = DBManager(partitioned=CONFIG['POSTS_PARTITIONING'])
     try:
         await db.initialize()
     except Exception as e:
         print(f"❌ Ошибка инициализации БД: {e}")
-        await tg_client.disconnect()
+        await pool.disconnect()
         return
 
-    scraper = TGScraper(tg_client, CONFIG['POST_LIMIT'], db, 'media')
+    vector_db = None
+    if CONFIG['DEDUP_ENABLED']:
+        vector_db = VectorDB(
+            CONFIG['DEDUP_INDEX_PATH'],
+            model_name=CONFIG['DEDUP_MODEL'],
+            threshold=CONFIG['DEDUP_THRESHOLD'],
+            retention_days=CONFIG['RETENTION_DAYS']
+        )
+        try:
+            await vector_db.load()
+        except Exception as e:
+            print(f"❌ Не удалось загрузить векторный индекс, поиск дубликатов отключён: {e}")
+            vector_db = None
+
+    # Кэш username -> peer у каждого аккаунта, чтобы не упираться в лимиты ResolveUsername
+    pool.use_peer_cache(db, ttl=CONFIG['PEER_CACHE_TTL_HOURS'] * 3600)
+    # Задания делятся между всеми запущенными воркерами через аренду в БД
+    jobs = JobQueue(db, CONFIG['WORKER_ID'], lease_seconds=CONFIG['JOB_LEASE_SECONDS'])
+    await jobs.register('scrape', CONFIG['CHANNELS'])
+    await jobs.register('publish', [CONFIG['MY_CHANNEL']])
+    # Event loop держит на задачу только слабую ссылку
+    keep_alive_task = asyncio.create_task(jobs.keep_alive())
+
+    # Парсинг и публикация идут одновременно, между ними - очередь постов в БД
+    queue = PublishQueue(
+        db,
+        limit=CONFIG['PUBLISH_BACKLOG_LIMIT'],
+        max_attempts=CONFIG['PUBLISH_MAX_ATTEMPTS']
+    )
+
+    store = MediaStore(media_folder)
+    downloader = MediaDownloader(
+        tg_client,
+        workers=CONFIG['DOWNLOAD_WORKERS'],
+        max_concurrency=CONFIG['DOWNLOAD_CONCURRENCY'],
+        max_file_size=CONFIG['MAX_MEDIA_SIZE_MB'] * 1024 * 1024 or None,
+        allowed_types=CONFIG['MEDIA_TYPES'] or None,
+        store=store,
+        reference_only=CONFIG['MEDIA_MODE'] == 'reference',
+        pool=pool
+    )
+    scraper = TGScraper(
+        tg_client,
+        CONFIG['POST_LIMIT'],
+        db,
+        'media',
+        request_interval=CONFIG['TG_REQUEST_INTERVAL'],
+        backfill=CONFIG['SCRAPE_BACKFILL'],
+        downloader=downloader,
+        vector_db=vector_db,
+        pool=pool,
+        queue=queue
+    )
+    compressor = None
+    if CONFIG['RECOMPRESS'] and CONFIG['MEDIA_MODE'] == 'download':
+        compressor = MediaCompressor(
+            workers=CONFIG['RECOMPRESS_WORKERS'],
+            max_side=CONFIG['RECOMPRESS_MAX_SIDE'],
+            quality=CONFIG['RECOMPRESS_QUALITY'],
+            video_mode=CONFIG['RECOMPRESS_VIDEO'],
+            max_video_height=CONFIG['RECOMPRESS_VIDEO_HEIGHT']
+        )
     publisher = PostPublisher(
         tg_client,
         db,
         target_channel=CONFIG['MY_CHANNEL'],
-        post_delay=CONFIG['PUBLISH_DELAY']
+        rate_per_minute=CONFIG['PUBLISH_RATE'],
+        burst=CONFIG['PUBLISH_BURST'],
+        rate_limits=CONFIG['PUBLISH_RATE_LIMITS'],
+        max_attempts=CONFIG['PUBLISH_MAX_ATTEMPTS'],
+        page_size=CONFIG['PUBLISH_PAGE_SIZE'],
+        media_mode=CONFIG['MEDIA_MODE'],
+        store=store,
+        peers=pool.primary.peers,
+        jobs=jobs,
+        compressor=compressor,
+        caption_overflow=CONFIG['CAPTION_OVERFLOW'],
+        account_name=pool.primary.name
     )
 
+    if CONFIG['METRICS_PORT']:
+        metrics.REGISTRY.add_collector(db.collect_metrics)
+        await metrics.start_http_server(CONFIG['METRICS_PORT'], CONFIG['METRICS_HOST'])
+
+    janitor = MediaJanitor(
+        db,
+        media_folder,
+        interval=CONFIG['JANITOR_INTERVAL'],
+        retention_days=CONFIG['RETENTION_DAYS'],
+        quota_bytes=CONFIG['MEDIA_QUOTA_MB'] * 1024 * 1024 or None,
+        published_retention_days=CONFIG['PUBLISHED_RETENTION_DAYS']
+    )
+    await janitor.reconcile(downloader if CONFIG['MEDIA_SHARED'] else None)
+    janitor_task = asyncio.create_task(janitor.run_forever())
+
+    if CONFIG['REALTIME']:
+        await run_realtime(scraper, publisher, vector_db, jobs, queue)
+        return
+
+    await asyncio.gather(
+        scrape_loop(scraper, vector_db, jobs, CONFIG['PARSE_INTERVAL']),
+        publish_loop(publisher, queue, CONFIG['JOB_POLL_INTERVAL'])
+    )
+
+async def scrape_due_channels(scraper, jobs, interval):
+    """Парсит каналы, которые удалось взять в аренду, и откладывает их на interval.
+
+    Воркер держит не больше SCRAPE_CONCURRENCY каналов на аккаунт и берёт
+    следующий, только когда освобождается место: остальные подошедшие
+    каналы достаются другим воркерам.
+    """
+    slots = max(1, CONFIG['SCRAPE_CONCURRENCY']) * scraper.pool.size
+    started = time.monotonic()
+    running: dict[asyncio.Task, str] = {}
+    results = []
+    while True:
+        if len(running) < slots:
+            for channel in await jobs.claim('scrape', limit=slots - len(running)):
+                running[asyncio.create_task(scraper.scrape_channel(channel))] = channel
+        if not running:
+            break
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            channel = running.pop(task)
+            await jobs.release('scrape', [channel], next_run_in=interval)
+            results.append(task.result())
+    if not results:
+        return None
+    return scraper.summarize(results, time.monotonic() - started)
+
+async def scrape_loop(scraper, vector_db, jobs, interval):
+    """Новые посты сразу уходят в очередь, публикатор их не ждёт до конца цикла"""
     while True:
-        for channel in CONFIG['CHANNELS']:
-            await scraper.scrape_posts_from_one_channel(channel)
-            print(f'Посты с канала {channel} распаршены, перехожу к следующему каналу')
+        await scrape_due_channels(scraper, jobs, interval)
+        if vector_db is not None:
+            await vector_db.evict_expired()
+        await asyncio.sleep(CONFIG['JOB_POLL_INTERVAL'])
 
+async def publish_loop(publisher, queue, timeout):
+    while True:
         await publisher.publish_posts()
-        print(f'Все посты опубликованы, следующий парсинг через {CONFIG["PARSE_INTERVAL"]}')
-        await asyncio.sleep(CONFIG['PARSE_INTERVAL'])
+        await queue.wait_for_posts(timeout)
+
+async def run_realtime(scraper, publisher, vector_db, jobs, queue):
+    # Обновления канала обрабатывает только воркер, у которого аренда 'realtime'
+    # на этот канал, иначе каждый воркер скачивал бы каждый новый пост
+    await jobs.register('realtime', CONFIG['CHANNELS'])
+    listener = RealtimeListener(
+        scraper,
+        CONFIG['CHANNELS'],
+        on_new_posts=queue.notify,
+        owns=lambda channel: jobs.holds('realtime', channel)
+    )
+    await listener.start()
+
+    async def claim_realtime():
+        # Аренду держит keep_alive; каналы упавшего воркера подбираем здесь
+        limit = CONFIG['REALTIME_CHANNELS_PER_WORKER']
+        while True:
+            free = limit - len(jobs.held('realtime')) if limit else None
+            if free is None or free > 0:
+                claimed = await jobs.claim('realtime', limit=free)
+                if claimed:
+                    print(f"📡 Real-time: взяли каналы {', '.join('@' + name for name in claimed)}")
+            await asyncio.sleep(CONFIG['JOB_POLL_INTERVAL'])
+
+    # Опрос только подбирает то, что могло потеряться при переподключениях
+    await asyncio.gather(
+        claim_realtime(),
+        scrape_loop(scraper, vector_db, jobs, CONFIG['GAP_FILL_INTERVAL']),
+        publish_loop(publisher, queue, CONFIG['GAP_FILL_INTERVAL'])
+    )
 
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file